@@ -0,0 +1,256 @@
+'''Times geg's stages on synthetic diagnostics, and checks them against benchBaseline.json.
+
+    $ python bench.py                     # time every shape
+    $ python bench.py --check             # fail if a stage got much slower, or bigger, than the baseline
+    $ python bench.py --update-baseline   # record this machine's numbers as the baseline
+'''
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from geg import geg
+
+baselinePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchBaseline.json')
+
+# name: (issues, note depth, notes per issue, template depth, message length)
+shapes = {
+    'many':  (200, 1, 2, 2, 150),
+    'deep':  (2, 4, 2, 6, 2000),
+    'giant': (1, 1, 1, 12, 100000),
+}
+
+stages = ['ingest', 'sanitize', 'modSubstring', 'justify', 'render']
+
+scopes = ['std', 'std::__cxx11', 'boost::asio', 'boost::mpl::v2_1', 'app::detail']
+names = ['basic_string', 'vector', 'map', 'pair', 'tuple', 'unique_ptr', 'function', 'variant', 'Widget', 'Handler']
+leaves = ['char', 'int', 'double', 'std::char_traits<char>', 'std::allocator<char>', 'const char*', 'unsigned int&']
+files = ['/usr/include/c++/12/bits/stl_map.h', '/usr/include/c++/12/ostream', '/usr/include/boost/asio/io_context.hpp',
+         'src/widget.cpp', 'src/detail/handlers.hpp', 'test/badCode00.cpp']
+
+
+def makeType(rng, depth):
+    '''A templated type nested depth deep, spaced the way gcc spaces them.'''
+    if depth == 0:
+        return rng.choice(leaves)
+    args = ', '.join(makeType(rng, depth - 1) for _ in range(rng.randint(1, 2)))
+    closer = ' >' if args.endswith('>') else '>'
+    return f'{rng.choice(scopes)}::{rng.choice(names)}<{args}{closer}'
+
+
+def makeMessage(rng, templateDepth, length):
+    '''A message about as long as length, made of quoted types like gcc's.'''
+    parts = []
+    total = 0
+    while total < length:
+        kind = rng.randrange(3)
+        if kind == 0:
+            part = f'no match for ‘operator<<’ (operand types are ‘{makeType(rng, templateDepth)}’ and ‘int’)'
+        elif kind == 1:
+            part = f'candidate: ‘{makeType(rng, templateDepth)}::operator()({makeType(rng, templateDepth // 2)}&)’'
+        else:
+            typ = makeType(rng, templateDepth)
+            part = f'cannot convert ‘{typ}’ to ‘{rng.choice(names)}’ {{aka ‘{typ}’}}'
+        parts.append(part)
+        total += len(part) + 2
+    return '; '.join(parts)
+
+
+def makeBlock(rng, kind, noteDepth, notesPer, templateDepth, length):
+    block = {
+        'kind': kind,
+        'message': makeMessage(rng, templateDepth, rng.randint(length // 2, length)),
+        'locations': [{'caret': {'file': rng.choice(files), 'line': rng.randint(1, 5000), 'column': rng.randint(1, 80)}}],
+    }
+    if noteDepth > 0:
+        block['children'] = [makeBlock(rng, 'note', noteDepth - 1, notesPer, templateDepth, length)
+                             for _ in range(notesPer)]
+    return block
+
+
+def makeStash(issues, noteDepth, notesPer, templateDepth, length, seed=0):
+    '''The text of a synthetic stash, as gcc's -fdiagnostics-format=json would write it.'''
+    rng = random.Random(seed)
+    blocks = [makeBlock(rng, rng.choice(['error', 'warning']), noteDepth, notesPer, templateDepth, length)
+              for _ in range(issues)]
+    return json.dumps(blocks)
+
+
+def allMessages(issues):
+    messages = []
+    def collect(block):
+        messages.append(block['message'])
+        for chBlock in block.get('children', []):
+            collect(chBlock)
+    for issue in issues:
+        messages.append(issue.message)
+        for block in issue.childBlocks + issue.noteBlocks:
+            collect(block)
+    return messages
+
+
+def ingest(stash):
+    return list(geg.dedupIssues(geg.buildIssues(geg.readDiagnosticBlocks(io.StringIO(stash)))))
+
+
+def renderAll(issues):
+    '''Render every issue opened, with its message expanded, the way a batch would write it.'''
+    for issue in issues:
+        issue.toggleAllIssues()
+        issue.toggleAllMessages()
+    writer = geg.BatchWriter(io.StringIO(), 100)
+    for issue in issues:
+        writer.write(issue)
+
+
+def timeStages(stash):
+    '''Run each stage over a stash, returning {stage: (seconds, units)}. Each stage's throughput is
+    units per second: bytes of JSON to ingest, and bytes of message text to the rest.'''
+    results = {}
+    # so every stage does its work from scratch
+    geg.forgetCaches()
+
+    start = time.perf_counter()
+    issues = ingest(stash)
+    results['ingest'] = (time.perf_counter() - start, len(stash))
+
+    messages = allMessages(issues)
+    textLength = sum(len(message) for message in messages)
+
+    start = time.perf_counter()
+    trees = [geg.sanitizeMessage(message, False, False) for message in messages]
+    results['sanitize'] = (time.perf_counter() - start, textLength)
+
+    # lift each word of every message into a node, right to left, then ever longer prefixes, which take the words in them along
+    start = time.perf_counter()
+    for message in messages:
+        node = geg.ModdedString(message)
+        pos = len(message)
+        while pos > 0:
+            wordStart = message.rfind(' ', 0, pos - 1) + 1
+            if wordStart < pos:
+                node.modSubstring(wordStart, pos, geg.Style.CODE)
+            pos = wordStart - 1
+        step = 4
+        while len(node.string) > step:
+            node.modSubstring(0, step, geg.Style.SCOPE)
+            step *= 2
+    results['modSubstring'] = (time.perf_counter() - start, textLength)
+
+    rendered = [tree.render() for tree in trees]
+    start = time.perf_counter()
+    for message in rendered:
+        geg.justifyMessage(message, 24, 100, geg.ribbonColors[0])
+    results['justify'] = (time.perf_counter() - start, textLength)
+
+    geg.forgetCaches()
+    start = time.perf_counter()
+    renderAll(issues)
+    results['render'] = (time.perf_counter() - start, textLength)
+
+    return results
+
+
+def peakMemory(stash):
+    '''The most memory it takes to read a stash and render all of it, in bytes. Tracing makes
+    everything several times slower, so it isn't done while timing.'''
+    geg.forgetCaches()
+    tracemalloc.start()
+    renderAll(ingest(stash))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def runShapes(names, repeats):
+    report = {}
+    for name in names:
+        stash = makeStash(*shapes[name])
+        best = {}
+        for _ in range(repeats):
+            for stage, (seconds, units) in timeStages(stash).items():
+                if stage not in best or seconds < best[stage][0]:
+                    best[stage] = (seconds, units)
+        report[name] = {stage: {'seconds': round(seconds, 4), 'MBps': round(units / seconds / 1e6, 3)}
+                        for stage, (seconds, units) in best.items()}
+        report[name]['peakMB'] = round(peakMemory(stash) / 1e6, 2)
+    return report
+
+
+def printReport(report, baseline):
+    print (f'{"shape":8}{"stage":14}{"seconds":>10}{"MB/s":>10}{"baseline":>10}')
+    for name, results in report.items():
+        for stage in stages:
+            result = results[stage]
+            was = baseline.get(name, {}).get(stage, {}).get('MBps')
+            print (f'{name:8}{stage:14}{result["seconds"]:>10.4f}{result["MBps"]:>10.3f}'
+                   f'{"" if was is None else f"{was:>10.3f}"}')
+        was = baseline.get(name, {}).get('peakMB')
+        print (f'{name:8}{"peak MB":14}{results["peakMB"]:>20.2f}{"" if was is None else f"{was:>10.2f}"}')
+
+
+def regressions(report, baseline, tolerance):
+    '''The stages slower, or shapes bigger, than the baseline by more than tolerance times.'''
+    found = []
+    for name, results in report.items():
+        if name not in baseline:
+            continue
+        for stage in stages:
+            was = baseline[name].get(stage, {}).get('MBps')
+            if was is not None and results[stage]['MBps'] * tolerance < was:
+                found.append(f'{name} {stage}: {results[stage]["MBps"]:.3f} MB/s, baseline {was:.3f}')
+        was = baseline[name].get('peakMB')
+        if was is not None and results['peakMB'] > was * tolerance:
+            found.append(f'{name} peak: {results["peakMB"]:.2f} MB, baseline {was:.2f}')
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Times geg's stages on synthetic diagnostics.")
+    parser.add_argument('shapes', nargs='*', metavar='shape',
+        help=f'which shapes of stash to time: {", ".join(shapes)} (default: all of them)')
+    parser.add_argument('-r', '--repeats', type=int, default=3,
+        help='time each stage this many times, and keep the best (default: 3)')
+    parser.add_argument('--check', action='store_true',
+        help='exit with 1 if a stage is slower, or a shape bigger, than the baseline by more than --tolerance')
+    parser.add_argument('--tolerance', type=float, default=2.0,
+        help='how many times slower or bigger than the baseline counts as a regression (default: 2)')
+    parser.add_argument('--update-baseline', action='store_true', dest='updateBaseline',
+        help='write these numbers to benchBaseline.json')
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    for name in args.shapes:
+        if name not in shapes:
+            parser.error(f'no shape called {name}')
+
+    # parses shouldn't come from, or go to, the machine's tree cache
+    geg.treeStore.broken = True
+
+    try:
+        with open(baselinePath) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    report = runShapes(args.shapes or list(shapes), args.repeats)
+    printReport(report, baseline)
+
+    if args.updateBaseline:
+        baseline.update(report)
+        with open(baselinePath, 'w') as f:
+            json.dump(baseline, f, indent=4)
+            f.write('\n')
+
+    if args.check:
+        found = regressions(report, baseline, args.tolerance)
+        for regression in found:
+            print (f'regressed: {regression}')
+        return 1 if len(found) > 0 else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
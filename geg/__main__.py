@@ -1,3 +1,4 @@
+import sys
 from .geg import main
 
-main()
+sys.exit(main())
@@ -1,4 +1,6 @@
 off = '\033[0m'
+# whether the Rgb escapes and off are made at all
+colored = True
 
 dk_black_fg = '\033[30m'
 dk_red_fg = '\033[31m'
@@ -29,10 +31,20 @@ dk_cyan_bg     = '\033[48;2;0;15;15m'
 dk_white_bg    = '\033[48;2;15;15;15m'
 
 
+def setColored(enabled):
+    '''Make the Rgb escapes and off empty, for output that isn't going to a terminal.'''
+    global colored, off
+    colored = enabled
+    off = '\033[0m' if enabled else ''
+
 def rgb_fg(r, g, b):
+    if not colored:
+        return ''
     return f'\033[38;2;{r};{g};{b}m'
 
 def rgb_bg(r, g, b):
+    if not colored:
+        return ''
     return f'\033[48;2;{r};{g};{b}m'
 
 
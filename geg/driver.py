@@ -0,0 +1,76 @@
+import os
+import json
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CompileCommand:
+    def __init__(self, directory, arguments, file):
+        self.directory = directory
+        self.arguments = arguments
+        self.file = file
+
+
+def loadCompileCommands(path):
+    '''Read a compile_commands.json, as written by cmake, bear, meson and friends.'''
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list):
+        raise ValueError('expected a list of compile commands')
+
+    commands = []
+    for entry in entries:
+        try:
+            directory = entry.get('directory', os.path.dirname(os.path.abspath(path)))
+            if 'arguments' in entry:
+                arguments = entry['arguments']
+            else:
+                arguments = shlex.split(entry['command'])
+            commands.append(CompileCommand(directory, arguments, os.path.join(directory, entry['file'])))
+        except (AttributeError, KeyError, TypeError) as e:
+            raise ValueError(f'not a compile command: {entry!r}') from e
+
+    return commands
+
+
+def exitCodeOf(returnCode):
+    '''A process's return code as a shell reports it: killed by signal N is 128 + N.'''
+    return 128 - returnCode if returnCode < 0 else returnCode
+
+
+def runCompileCommand(command):
+    '''Compile one TU, returning its stderr and exit code. A compiler that can't be run fails the
+    TU like the shell would, with 127 and why.'''
+    try:
+        proc = subprocess.run(command.arguments, cwd=command.directory, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, encoding='utf-8', errors='replace', check=False)
+    except OSError as e:
+        return f'Could not run {command.arguments[0]}: {e}\n', 127
+    return proc.stderr, exitCodeOf(proc.returncode)
+
+
+class BuildDriver:
+    '''Runs compile commands on a bounded pool, at most 'jobs' compilers at a time. The pool's
+    threads only wait on the compiler processes, which do the real work on their own cores.'''
+    def __init__(self, commands, jobs=None):
+        self.commands = commands
+        self.jobs = jobs or os.cpu_count() or 1
+        # the first TU's to fail
+        self.returnCode = 0
+
+
+    def results(self):
+        '''Yield (command, stderr) for each command, in the order given. Each is yielded as soon as
+        it and all the commands before it have finished, while the rest keep compiling.'''
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = [pool.submit(runCompileCommand, command) for command in self.commands]
+            try:
+                for command, future in zip(self.commands, futures):
+                    stderr, returnCode = future.result()
+                    if self.returnCode == 0:
+                        self.returnCode = returnCode
+                    yield command, stderr
+            finally:
+                for future in futures:
+                    future.cancel()
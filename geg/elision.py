@@ -0,0 +1,132 @@
+import os
+import re
+import hashlib
+
+# Elision rules: types to cut out of messages before they're parsed, template arguments and all, so
+# noise like default allocators is never styled, rendered or wrapped. They're read from .gegrules in
+# the project, next to the stash, and in the home directory. Each line names a type as gcc prints
+# it, fully qualified, where * stands for any one name; blank lines and lines starting with # are
+# skipped:
+#   std::allocator
+#   std::char_traits
+#   app::policy::*
+# An elided template argument after the first goes with its comma, as it's almost always one that
+# was defaulted; anywhere else, an elided type leaves '…' in its place.
+rulesFileName = '.gegrules'
+elidedMark = '…'
+
+patternRegex = re.compile(r'(?:[A-Za-z_*][A-Za-z0-9_*]*::)*[A-Za-z_*][A-Za-z0-9_*]*')
+bracketRegex = re.compile(r'[<>()\[\]{}’]')
+closers = {'>': '<', ')': '(', ']': '[', '}': '{'}
+
+patterns = []
+regex = None
+
+
+def compilePattern(pattern):
+    return re.escape(pattern).replace(r'\*', '[A-Za-z0-9_]+')
+
+
+def setRules(newPatterns):
+    '''Elide the types matching each of newPatterns from now on.'''
+    global patterns, regex
+    patterns = list(newPatterns)
+    if len(patterns) == 0:
+        regex = None
+        return
+    alternatives = '|'.join(compilePattern(pattern) for pattern in sorted(patterns, key=len, reverse=True))
+    # only whole names: not part of a longer one, nor the scope of one
+    regex = re.compile(rf'(?<![A-Za-z0-9_:])(?:{alternatives})(?![A-Za-z0-9_]|::)')
+
+
+def readRules(path):
+    '''The patterns in a rules file, or none if there isn't one.'''
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return []
+
+    found = []
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        if not patternRegex.fullmatch(line):
+            raise ValueError(f'{path}:{i + 1}: "{line}" isn\'t a type name')
+        found.append(line)
+    return found
+
+
+def load(projectDirectory):
+    '''Read the rules in the home directory's rules file, and the project's.'''
+    paths = [os.path.join(os.path.expanduser('~'), rulesFileName),
+             os.path.join(os.path.abspath(projectDirectory), rulesFileName)]
+    found = []
+    for path in dict.fromkeys(paths):
+        found.extend(readRules(path))
+    setRules(dict.fromkeys(found))
+
+
+def digest():
+    '''Identifies the rules, since they change what's parsed from a message.'''
+    return hashlib.blake2b('\n'.join(patterns).encode(), digest_size=16).digest()
+
+
+def closeOf(text, start):
+    '''Where the template arguments opening at text[start] end, or None if they don't.'''
+    depth = 0
+    for m in bracketRegex.finditer(text, start):
+        ch = m.group()
+        if ch == '<':
+            depth += 1
+        elif ch == '>':
+            depth -= 1
+            if depth == 0:
+                return m.end()
+        elif ch == '’':
+            return None
+    return None
+
+
+def elide(text):
+    '''The text with every type the rules match cut out.'''
+    if regex is None:
+        return text
+
+    pieces = []
+    pos = 0
+    # the brackets open at pos, to tell template arguments from anything else after a comma
+    opened = []
+    for m in regex.finditer(text):
+        if m.start() < pos:
+            continue
+        end = m.end()
+        if text.startswith('<', end):
+            end = closeOf(text, end)
+            if end is None:
+                continue
+
+        for b in bracketRegex.finditer(text, pos, m.start()):
+            ch = b.group()
+            if ch == '’':
+                opened.clear()
+            elif ch in closers:
+                if len(opened) > 0 and opened[-1] == closers[ch]:
+                    opened.pop()
+            else:
+                opened.append(ch)
+
+        before = text[pos : m.start()]
+        stripped = before.rstrip(' ')
+        if stripped.endswith(',') and len(opened) > 0 and opened[-1] == '<':
+            pieces.append(stripped[:-1])
+        else:
+            pieces.append(before)
+            pieces.append(elidedMark)
+        pos = end
+
+    if pos == 0:
+        return text
+    pieces.append(text[pos:])
+    return ''.join(pieces)
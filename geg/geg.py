@@ -1,15 +1,31 @@
 import sys
 import os
+import io
 import json
 import subprocess
 from pathlib import Path
 from . import ansi as a
+from . import driver
+from . import stashcache
+from . import treecache
+from . import instrument
+from . import elision
 import shutil
 import re
 import math
-import copy
 from enum import Enum
 import functools
+import bisect
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import threading
+import argparse
+import asyncio
+import codecs
+import shlex
+import hashlib
 
 compileErrorsPath = './.gegstash.json'
 
@@ -21,56 +37,113 @@ def printDebug(level, string):
 
 codeRegex = re.compile(r'‘[^’]+?’')
 operatorRegex = re.compile(r'operator(.+?)\(')
-ansiRegex = re.compile(r'\033\[(.*?)m')
+ansiRegex = re.compile(r'\033\[[^m]*m')
 akaRegex = re.compile(r' \{aka ‘.*?’\}')
 scopedTypeRegex =   re.compile(r'((?:[a-zA-Z0-9_]+::)+)([a-zA-Z0-9_&*.]+)')
 scopeLayerRegex =   re.compile(r'([a-zA-Z0-9_]+::)')
 templateTypeRegex = re.compile(r'([a-zA-Z0-9_]+)<>::')
+gccDriverRegex =    re.compile(r'^(?:.*-)?(?:gcc|g\+\+|c\+\+|cc)(?:-[0-9.]+)?$')
+
+sourceExtensions = {'.c', '.cc', '.cp', '.cpp', '.cxx', '.c++', '.C', '.CPP', '.ii', '.i'}
 
 
 def doShellCommand(cmd):
-    print (f"{a.Rgb(63, 63, 63).fg()}{cmd}{a.off}")
-    return subprocess.run(cmd, shell=True, check=False, encoding='utf-8', capture_output=True)
+    '''Start the command with its stderr on a pipe, so diagnostics can be read while it runs.'''
+    print (f"{a.Rgb(63, 63, 63).fg()}{shlex.join(cmd)}{a.off}")
+    return subprocess.Popen(cmd, stderr=subprocess.PIPE, encoding='utf-8', errors='replace')
+
+
+def makeJsonCommand(cmd):
+    '''Ask gcc drivers for JSON diagnostics, unless the command already chose a format.'''
+    if (gccDriverRegex.match(os.path.basename(cmd[0])) and
+        not any(arg.startswith('-fdiagnostics-format') for arg in cmd)):
+        return cmd + ['-fdiagnostics-format=json']
+    return cmd
+
+
+def sourceFileOf(cmd):
+    '''The one C or C++ source a compile command builds, if it builds just one.'''
+    sources = [arg for arg in cmd[1:] if os.path.splitext(arg)[1] in sourceExtensions]
+    return sources[0] if len(sources) == 1 else None
+
+
+class TeeReader:
+    '''Reads lines from a stream, copying everything read into a sink as it goes.'''
+    def __init__(self, stream, sink):
+        self.stream = stream
+        self.sink = sink
+
+    def readline(self, size=-1):
+        line = self.stream.readline(size)
+        if len(line) > 0:
+            self.sink.write(line)
+            self.sink.flush()
+        return line
 
 
 def strNoColor(string):
     return re.sub(ansiRegex, lambda m: '', string)
 
 
+@functools.lru_cache(maxsize=None)
+def charWidth(ch):
+    '''How many terminal columns a character takes: two for wide ones, none for combining marks.'''
+    if unicodedata.combining(ch):
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+
+
 def justifyMessage(message, start, width, ribbonColor):
     '''Print the message, with spaces to offset, and spaces to round out the bg color at the end of each line.'''
-    src = ''
+    out = []
     chonkLen = width - start - 1
     chonkRemaining = chonkLen
 
-    cursor = 0
     colorBank = 0
-
     currentColors = ['', '']
-    while cursor < len(message):
-        if message[cursor:].startswith('\033['):
-            colorStart = cursor
-            cursor += len('\033[')
-            while message[cursor] != 'm':
-                cursor += 1
-            cursor += 1
-            colorEnd = cursor
-            currentColors[colorBank] = message[colorStart:colorEnd]
-            src += currentColors[colorBank]
-            colorBank = 1 - colorBank
-        else:
-            src += message[cursor]
-            chonkRemaining -= 1
-            cursor += 1
 
-        if chonkRemaining == 0 and cursor < len(message):
-            src += f'{a.off}\n{ribbonColor}    {a.off}{" " * (start - 4)}{currentColors[0]}{currentColors[1]}'
-            chonkRemaining = chonkLen
+    def wrapLine():
+        nonlocal chonkRemaining
+        out.append(f'{a.off}\n{ribbonColor}    {a.off}{" " * (start - 4)}{currentColors[0]}{currentColors[1]}')
+        chonkRemaining = chonkLen
+
+    cursor = 0
+    for m in [*ansiRegex.finditer(message), None]:
+        runEnd = len(message) if m is None else m.start()
+        if chonkLen <= 0:
+            out.append(message[cursor:runEnd])
+            chonkRemaining -= runEnd - cursor
+        elif message.isascii() or message[cursor:runEnd].isascii():
+            while cursor < runEnd:
+                chonk = min(runEnd - cursor, chonkRemaining)
+                out.append(message[cursor:cursor + chonk])
+                cursor += chonk
+                chonkRemaining -= chonk
+                if chonkRemaining == 0 and cursor < len(message):
+                    wrapLine()
+        else:
+            for cursor in range(cursor, runEnd):
+                w = charWidth(message[cursor])
+                if w > chonkRemaining and chonkRemaining < chonkLen:
+                    out.append(' ' * chonkRemaining)
+                    wrapLine()
+                out.append(message[cursor])
+                chonkRemaining -= w
+                if chonkRemaining <= 0 and cursor + 1 < len(message):
+                    wrapLine()
+
+        if m is not None:
+            currentColors[colorBank] = m.group()
+            out.append(m.group())
+            colorBank = 1 - colorBank
+            cursor = m.end()
+            if chonkRemaining == 0 and cursor < len(message):
+                wrapLine()
 
-    src += ' ' * chonkRemaining
-    src += a.off
+    out.append(' ' * chonkRemaining)
+    out.append(a.off)
 
-    return src
+    return ''.join(out)
 
 
 class Style(Enum):
@@ -100,22 +173,36 @@ class Style(Enum):
             raise RuntimeError('Styles must be a dict, list, or Style')
 
     @staticmethod
-    def cascadeStyles(ontoStyles, fromStyles):
-        ontoStyles = Style.normalizeStyles(ontoStyles)
-        fromStyles = Style.normalizeStyles(fromStyles)
-
-        # these styles don't cascade
-        fromStyles.pop(Style.SCOPE, None)
-        fromStyles.pop(Style.NOISY, None)
-        fromStyles.pop(Style.OPERATOR, None)
-
-        sts = copy.deepcopy(ontoStyles)
-        for s, c in fromStyles.items():
-            if s in sts:
-                sts[s] += c
+    def keyOf(styles):
+        '''Pack styles into an int: one bit per style, and the TEMPLATEARGS depth above those.'''
+        key = 0
+        for s, c in Style.normalizeStyles(styles).items():
+            if s == Style.TEMPLATEARGS:
+                key += c * templateDepthUnit
             else:
-                sts[s] = c
-        return sts
+                key |= 1 << s.value
+        return key
+
+    @staticmethod
+    def stylesOf(key):
+        styles = {s:1 for s in Style if key & (1 << s.value) and s != Style.TEMPLATEARGS}
+        if key >= templateDepthUnit:
+            styles[Style.TEMPLATEARGS] = key // templateDepthUnit
+        return styles
+
+    @staticmethod
+    def cascadeKeys(ontoKey, fromKey):
+        # SCOPE, NOISY and OPERATOR don't cascade; template depths add up
+        return (ontoKey | (fromKey & cascadingStyles)) + (fromKey & ~styleBits)
+
+    @staticmethod
+    def colorsOf(key):
+        '''The (fg, bg) escapes for a style key, worked out once per key.'''
+        colors = styleColors.get(key)
+        if colors is None:
+            colors = Style.getColors(Style.stylesOf(key))
+            styleColors[key] = colors
+        return colors
 
     @staticmethod
     def getColors(styles):
@@ -172,17 +259,76 @@ class Style(Enum):
         return (fg.fg(), bg.bg())
 
 
+templateDepthUnit = 1 << len(Style)
+styleBits = templateDepthUnit - 1
+cascadingStyles = styleBits & ~(1 << Style.SCOPE.value | 1 << Style.NOISY.value | 1 << Style.OPERATOR.value)
+invisibleStyle = 1 << Style.INVISIBLE.value
+styleColors = {}
+
+
+def normalizeMessage(message):
+    return ' '.join(message.split()).replace(' >', '>')
+
+
 def sanitizePath(path, pathOpened):
     if pathOpened:
-        m = ModdedString(str(path), [], Style.PATH)
+        m = ModdedString(str(path), Style.PATH)
         d = path.parent
         m.modSubstring(0, len(str(d)), Style.DIR)
     else:
-        m = ModdedString(str(path.name), [], Style.PATH)
+        m = ModdedString(str(path.name), Style.PATH)
     return m.render()
 
 
+legacySanitizer = False
+
+def parsedText(message):
+    '''The text MessageParser styles, which is the message with its template closers tightened and
+    the types the elision rules match cut out.'''
+    return elision.elide(message.replace(' >', '>'))
+
+
 def sanitizeMessage(message, makeOpened, highlighted):
+    '''Parse a diagnostic's message into a styled ModdedString. With legacySanitizer set, the old
+    rewrite rules build it instead, for comparing the two.'''
+    if legacySanitizer:
+        return rewriteMessage(elision.elide(message), makeOpened, highlighted)
+    return MessageParser(makeOpened).parse(message, highlighted)
+
+
+def needsOf(*alternatives):
+    '''What a rule needs of a string to match it: all the characters of one of the alternatives.'''
+    return tuple(frozenset(alternative) for alternative in alternatives)
+
+
+def canMatch(needs, present):
+    for need in needs:
+        if need <= present:
+            return True
+    return False
+
+
+def applyRule(rules, nestedString, present):
+    '''Apply the first of the rewrite rules that matches, skipping the ones that need characters
+    that aren't present. Returns whether one did.'''
+    active = instrument.active
+    for name, needs, rule in rules:
+        if not canMatch(needs, present):
+            if active:
+                instrument.skip(f'legacy rule {name}')
+            continue
+        if active:
+            began = instrument.now()
+            hit = rule(nestedString)
+            instrument.record(f'legacy rule {name}', began, hit, False)
+        else:
+            hit = rule(nestedString)
+        if hit:
+            return True
+    return False
+
+
+def rewriteMessage(message, makeOpened, highlighted):
     sMessage = ''
     for i in range(0, len(message)):
         if message[i] == ' ' and i + 1 < len(message) and message[i + 1] == '>':
@@ -205,226 +351,733 @@ def sanitizeMessage(message, makeOpened, highlighted):
     if makeOpened:
         akaStyle = Style.AKA
 
-    def rec(nestedString):
-        # run until the string stops changing
-        refString = ''
-        while (nestedString.string != refString):
-            refString = nestedString.string
-
-            if (match := codeRegex.search(nestedString.string)):
-                newSub = nestedString.modSubstring(match.start() + 1, match.end() - 1, Style.CODE)
+    def codeSpan(nestedString):
+        if (match := codeRegex.search(nestedString.string)):
+            newSub = nestedString.modSubstring(match.start() + 1, match.end() - 1, Style.CODE)
+            rec(newSub)
+            return True
+        return False
+
+    def aka(nestedString):
+        if (match := akaRegex.search(nestedString.string)):
+            if match.end() - match.start() < len(nestedString.string):
+                newSub = nestedString.modSubstring(match.start(), match.end(), akaStyle)
                 rec(newSub)
-                continue
-
-            if (match := akaRegex.search(nestedString.string)):
-                if match.end() - match.start() < len(nestedString.string):
-                    newSub = nestedString.modSubstring(match.start(), match.end(), akaStyle)
+                return True
+        return False
+
+    def operator(nestedString):
+        if match := operatorRegex.search(nestedString.string):
+            newSub = nestedString.modSubstring(match.start() + len('operator'), match.end() - 1, Style.OPERATOR)
+            rec(newSub)
+            return True
+        return False
+
+    def findSeq(seq, styles={}):
+        def rule(nestedString):
+            if (tn := nestedString.string.find(seq)) >= 0:
+                nestedString.modSubstring(tn, tn + len(seq), styles)
+                return True
+            return False
+        return rule
+
+    def findPairOf(startCh, endCh, styles={}):
+        def rule(nestedString):
+            lessPos = -1
+            for i, ch in enumerate(nestedString.string):
+                if ch == startCh:
+                    if i < len(nestedString.string) - 1 and nestedString.string[i + 1] != endCh:
+                        lessPos = i
+                if ch == endCh and lessPos > -1 and i > 0 and nestedString.string[i - 1] != startCh:
+                    if lessPos + 1 < i:
+                        newSub = nestedString.modSubstring(lessPos + 1, i, styles)
                     rec(newSub)
-                    continue
-
-            if match := operatorRegex.search(nestedString.string):
-                newSub = nestedString.modSubstring(match.start() + len('operator'), match.end() - 1, Style.OPERATOR)
-                rec(newSub)
-                continue
-
-            if (tn := nestedString.string.find('typename ')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('typename '), Style.INVISIBLE)
-                continue
-
-            if (tn := nestedString.string.find('template')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('template'), Style.TYPE)
-                continue
-
-            def findPairOf(startCh, endCh, styles={}):
-                lessPos = -1
-                for i, ch in enumerate(nestedString.string):
-                    if ch == startCh:
-                        if i < len(nestedString.string) - 1 and nestedString.string[i + 1] != endCh:
-                            lessPos = i
-                    if ch == endCh and lessPos > -1 and i > 0 and nestedString.string[i - 1] != startCh:
-                        if lessPos + 1 < i:
-                            newSub = nestedString.modSubstring(lessPos + 1, i, styles)
+                    return True
+            return False
+        return rule
+
+    def findPairOf2(startSeq, endSeq, styles={}):
+        def rule(nestedString):
+            sn = len(nestedString.string)
+            while sn >= 0:
+                if (sn := nestedString.string[:sn].rfind(startSeq)) >= 0:
+                    en = nestedString.string[sn + len(startSeq):].find(endSeq) + sn + len(startSeq)
+                    if en > sn and (sn > 0 or en < len(nestedString.string) - 1):
+                        newSub = nestedString.modSubstring(sn, en + 1, styles)
                         rec(newSub)
                         return True
-                return False
-            
-            def findPairOf2(startSeq, endSeq, styles={}):
-                sn = len(nestedString.string)
-                while sn >= 0:
-                    if (sn := nestedString.string[:sn].rfind(startSeq)) >= 0:
-                        en = nestedString.string[sn + len(startSeq):].find(endSeq) + sn + len(startSeq)
-                        if en > sn and (sn > 0 or en < len(nestedString.string) - 1):
-                            newSub = nestedString.modSubstring(sn, en + 1, styles)
-                            rec(newSub)
-                            return True
-                return False
-
-
-            if findPairOf('<', '>', Style.TEMPLATEARGS):
-                continue
-
-            if findPairOf('(', ')', Style.PARAM):
-                continue
-
-            if findPairOf('[', ']'):
-                continue
-
-            if findPairOf('{', '}'):
-                continue
-
-            def findCommas():
-                for i, ch in enumerate(nestedString.string):
-                    if ch == ',':
-                        if i > 0:
-                            newSub = nestedString.modSubstring(0, i)
-                            rec(newSub)
-                            return True
-                        elif len(nestedString.string) > 1:
-                            newSub = nestedString.modSubstring(i + 1, len(nestedString.string))
-                            rec(newSub)
-                            return True
-                return False
-
-            if findCommas():
-                continue
+            return False
+        return rule
+
+    def findCommas(nestedString):
+        for i, ch in enumerate(nestedString.string):
+            if ch == ',':
+                if i > 0:
+                    newSub = nestedString.modSubstring(0, i)
+                    rec(newSub)
+                    return True
+                elif len(nestedString.string) > 1:
+                    newSub = nestedString.modSubstring(i + 1, len(nestedString.string))
+                    rec(newSub)
+                    return True
+        return False
+
+    def scopedType(nestedString):
+        match = scopedTypeRegex.search(nestedString.string)
+        if match and not nestedString.string.endswith('::'):
+            scopeStr = match.group(1)
+            typeStr = match.group(2)
+
+            newSub = nestedString.modSubstring(match.start(), match.end(), Style.TYPE)
+            newSub2 = newSub.modSubstring(0, len(scopeStr), scopeStyle)
+            rec(newSub)
+            rec(newSub2)
+            return True
+        return False
+
+    def templateType(nestedString):
+        match = templateTypeRegex.search(nestedString.string)
+        if match:
+            newSub = nestedString.modSubstring(match.start(), match.end() - 2, Style.TYPE)
+            rec(newSub)
+            return True
+        return False
+
+    def scopeLayer(nestedString):
+        match = scopeLayerRegex.search(nestedString.string)
+        if match and match.end() - match.start() < len(nestedString.string):
+            newSub = nestedString.modSubstring(match.start(), match.end(), scopeStyle)
+            rec(newSub)
+            return True
+        return False
+
+    def leading(seq, styles={}):
+        def rule(nestedString):
+            if nestedString.string.startswith(seq) and len(nestedString.string) > len(seq):
+                nestedString.modSubstring(0, len(seq), styles)
+                return True
+            return False
+        return rule
+
+    def trailing(ch, styles={}):
+        def rule(nestedString):
+            if nestedString.string.endswith(ch) and len(nestedString.string) > 1:
+                nestedString.modSubstring(len(nestedString.string) - 1, len(nestedString.string), styles)
+                return True
+            return False
+        return rule
+
+    def findOperator(seq):
+        def rule(nestedString):
+            if (tn := nestedString.string.find(seq)) >= 0 and len(nestedString.string) > len(seq):
+                nestedString.modSubstring(tn, tn + len(seq), Style.OPERATOR)
+                return True
+            return False
+        return rule
+
+    # in order of precedence, with the characters a string must hold for each to match
+    rules = [
+        ('code span',       needsOf('‘’'),                  codeSpan),
+        ('aka',             needsOf(' {aka‘’}'),            aka),
+        ('operator',        needsOf('operator('),           operator),
+        ('typename',        needsOf('typename '),           findSeq('typename ', Style.INVISIBLE)),
+        ('template',        needsOf('template'),            findSeq('template', Style.TYPE)),
+        ('<...>',           needsOf('<>'),                  findPairOf('<', '>', Style.TEMPLATEARGS)),
+        ('(...)',           needsOf('()'),                  findPairOf('(', ')', Style.PARAM)),
+        ('[...]',           needsOf('[]'),                  findPairOf('[', ']')),
+        ('{...}',           needsOf('{}'),                  findPairOf('{', '}')),
+        ('commas',          needsOf(','),                   findCommas),
+        ('allocator<',      needsOf('allocator<'),          findPairOf2('allocator<', '>', Style.DIM)),
+        ('char_traits<',    needsOf('char_traits<'),        findPairOf2('char_traits<', '>', Style.DIM)),
+        ('basic_',          needsOf('basic_'),              findSeq('basic_', Style.DIM)),
+        ('const',           needsOf('const '),              findSeq('const ', Style.DIM)),
+        ('constexpr',       needsOf('constexpr '),          findSeq('constexpr ', Style.DIM)),
+        ('class',           needsOf('class '),              findSeq('class ', Style.DIM)),
+        ('struct',          needsOf('struct '),             findSeq('struct ', Style.DIM)),
+        ('scoped type',     needsOf(':'),                   scopedType),
+        ('template type',   needsOf('<>:'),                 templateType),
+        ('<>',              needsOf('<>'),                  findSeq('<>')),
+        ('()',              needsOf('()'),                  findSeq('()', [Style.PARAM, Style.OPERATOR])),
+        ('::type',          needsOf(':type'),               findSeq('::type', [noisyStyle, Style.TYPE])),
+        ('::value',         needsOf(':value'),              findSeq('::value', [noisyStyle, Style.TYPE])),
+        ('scope layer',     needsOf(':'),                   scopeLayer),
+        ('leading ::',      needsOf(':'),                   leading('::')),
+        ('leading space',   needsOf(' '),                   leading(' ')),
+        ('trailing space',  needsOf(' '),                   trailing(' ')),
+        ('leading _',       needsOf('_'),                   leading('_', noisyStyle)),
+        ('trailing _',      needsOf('_'),                   trailing('_', noisyStyle)),
+        ('&&',              needsOf('&'),                   findOperator('&&')),
+        ('&',               needsOf('&'),                   findOperator('&')),
+        ('*',               needsOf('*'),                   findOperator('*')),
+    ]
 
-            if findPairOf2('allocator<', '>', Style.DIM):
-                continue
+    def rec(nestedString):
+        # run until the string stops changing
+        refString = ''
+        while (nestedString.string != refString):
+            refString = nestedString.string
+            applyRule(rules, nestedString, set(refString))
 
-            if findPairOf2('char_traits<', '>', Style.DIM):
-                continue
+    ns = ModdedString(message, Style.HIGHLIGHT if highlighted else {})
+    rec(ns)
+    return ns
 
-            if (tn := nestedString.string.find('basic_')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('basic_'), Style.DIM)
-                continue
 
-            if (tn := nestedString.string.find('const ')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('const '), Style.DIM)
+bracketRegex =          re.compile(r'[<>()\[\]{}]')
+allocatorRegex =        re.compile(r'allocator<(?:[^>]*>)?')
+charTraitsRegex =       re.compile(r'char_traits<(?:[^>]*>)?')
+
+bracketPairs = [('<', '>', Style.TEMPLATEARGS), ('(', ')', Style.PARAM), ('[', ']', {}), ('{', '}', {})]
+
+
+def spliceMatches(node, matches):
+    '''Lift each (start, end, styles, parseChild) match of node's own text out into a child, and
+    parse the child with parseChild, unless it's None.'''
+    removed = 0
+    for start, end, styles, parseChild in matches:
+        child = node.modSubstring(start - removed, end - removed, styles)
+        if parseChild is not None:
+            parseChild(child)
+        removed += end - start
+
+
+def matchBrackets(string):
+    '''Pair up brackets: '<>' first, then '()' within each '<>' group, then '[]', then '{}'. A bracket
+    right next to its partner, like '<>', pairs with nothing. Returns {open: (close, styles)}.'''
+    events = [(m.start(), m.group()) for m in bracketRegex.finditer(string)]
+    pairs = {}
+    closers = set()
+    for openCh, closeCh, styles in bracketPairs:
+        stack = []
+        for i, ch in events:
+            if i in pairs:
+                stack.append(None)
+            elif i in closers:
+                while stack.pop() is not None:
+                    pass
+            elif ch == openCh:
+                if i + 1 < len(string) and string[i + 1] != closeCh:
+                    stack.append(i)
+            elif ch == closeCh:
+                if i > 0 and string[i - 1] != openCh and len(stack) > 0 and stack[-1] is not None:
+                    pairs[stack.pop()] = (i, styles)
+                    closers.add(i)
+    return pairs
+
+
+# The literal keywords MessageParser lifts out of fragments, as (keyword, rule, styles). They're all
+# found in one scan of a fragment, so adding more costs next to nothing. matchKeywords and
+# matchDimKeywords lift every keyword of theirs at once; matchSequences and matchOperators lift
+# only the first of theirs, in this order, that the fragment holds. NOISY is hidden until opened.
+keywordTable = [
+    ('typename ',   'matchKeywords',    Style.INVISIBLE),
+    ('template',    'matchKeywords',    Style.TYPE),
+    ('basic_',      'matchDimKeywords', Style.DIM),
+    ('const ',      'matchDimKeywords', Style.DIM),
+    ('constexpr ',  'matchDimKeywords', Style.DIM),
+    ('class ',      'matchDimKeywords', Style.DIM),
+    ('struct ',     'matchDimKeywords', Style.DIM),
+    ('<>',          'matchSequences',   {}),
+    ('()',          'matchSequences',   [Style.PARAM, Style.OPERATOR]),
+    ('::type',      'matchSequences',   [Style.NOISY, Style.TYPE]),
+    ('::value',     'matchSequences',   [Style.NOISY, Style.TYPE]),
+    ('&&',          'matchOperators',   Style.OPERATOR),
+    ('&',           'matchOperators',   Style.OPERATOR),
+    ('*',           'matchOperators',   Style.OPERATOR),
+]
+
+
+class KeywordScanner:
+    '''Finds every keyword of a keyword table in a string in one pass of one regex. Keywords may
+    overlap, as different rules want different ones. Where several start at once, the regex finds the
+    longest, and the others are prefixes of it, so they're counted as found too. The last string
+    scanned is remembered, since each rule that uses keywords asks in turn.'''
+    def __init__(self, table, makeOpened):
+        keywords = sorted({keyword for keyword, _, _ in table}, key=len, reverse=True)
+        self.regex = re.compile('(?=(' + '|'.join(re.escape(keyword) for keyword in keywords) + '))')
+        noisyStyle = Style.NOISY if makeOpened else Style.INVISIBLE
+        self.stylesOf = {}
+        self.order = {}
+        for keyword, rule, styles in table:
+            styles = Style.normalizeStyles(styles)
+            if Style.NOISY in styles:
+                styles = {noisyStyle if style == Style.NOISY else style: 1 for style in styles}
+            self.stylesOf[rule, keyword] = styles
+            self.order.setdefault(rule, []).append(keyword)
+        self.needs = {rule: needsOf(*keywords) for rule, keywords in self.order.items()}
+        # keyword: [(rule, keyword)] for it and each keyword it starts with, longest first
+        self.foundWith = {keyword: [(rule, prefix) for prefix in keywords if keyword.startswith(prefix)
+                                    for prefixOf, rule, _ in table if prefixOf == prefix]
+                          for keyword in keywords}
+        self.string = None
+        self.found = {}
+
+
+    def scan(self, string):
+        '''{rule: [(start, keyword)]} for every keyword in string, in order.'''
+        if string is not self.string:
+            found = {}
+            foundWith = self.foundWith
+            for m in self.regex.finditer(string):
+                for rule, keyword in foundWith[m.group(1)]:
+                    if rule in found:
+                        found[rule].append((m.start(), keyword))
+                    else:
+                        found[rule] = [(m.start(), keyword)]
+            self.string = string
+            self.found = found
+        return self.found
+
+
+# made for each of opened and closed on first use; forget them when keywordTable changes
+keywordScanners = {}
+
+
+def keywordScanner(makeOpened):
+    scanner = keywordScanners.get(makeOpened)
+    if scanner is None:
+        scanner = keywordScanners[makeOpened] = KeywordScanner(keywordTable, makeOpened)
+    return scanner
+
+
+# MessageParser's rules for a fragment, in order of precedence, with the characters it must hold for
+# each to match; None for the rules whose keywords are in keywordTable
+fragmentRuleTable = [
+    ('matchKeywords',       None),
+    ('matchNoise',          needsOf('allocator<', 'char_traits<')),
+    ('matchDimKeywords',    None),
+    ('matchScopedTypes',    needsOf(':')),
+    ('matchTemplateTypes',  needsOf('<>:')),
+    ('matchSequences',      None),
+    ('matchScopeLayers',    needsOf(':')),
+    ('matchEdges',          needsOf(':', ' ', '_')),
+    ('matchOperators',      None),
+]
+
+
+class MessageParser:
+    '''Builds a message's ModdedString in one pass over its brackets, then matches the rules against
+    each comma-separated fragment, instead of rewriting the whole message until it stops changing.'''
+    def __init__(self, makeOpened):
+        self.scopeStyle = Style.SCOPE if makeOpened else Style.INVISIBLE
+        self.noisyStyle = Style.NOISY if makeOpened else Style.INVISIBLE
+        self.akaStyle = Style.AKA if makeOpened else Style.INVISIBLE
+        self.makeOpened = makeOpened
+        self.keywords = keywordScanner(makeOpened)
+        self.fragmentRules = [(name, self.keywords.needs.get(name, ()) if needs is None else needs, getattr(self, name))
+                              for name, needs in fragmentRuleTable]
+
+
+    def parse(self, message, highlighted):
+        node = ModdedString(parsedText(message), Style.HIGHLIGHT if highlighted else {})
+
+        matches = [(m.start() + 1, m.end() - 1, Style.CODE, self.parseSequence)
+                   for m in codeRegex.finditer(node.string)]
+        spliceMatches(node, matches)
+
+        string = node.string
+        matches = [(m.start(), m.end(), self.akaStyle, self.parseSequence)
+                   for m in akaRegex.finditer(string) if m.end() - m.start() < len(string)]
+        spliceMatches(node, matches)
+
+        self.parseSequence(node)
+        return node
+
+
+    def parseSequence(self, node):
+        '''Parse text that may hold operators and brackets.'''
+        matches = [(m.start(1), m.end(1), Style.OPERATOR, self.parseSequence)
+                   for m in operatorRegex.finditer(node.string)]
+        spliceMatches(node, matches)
+
+        pairs = matchBrackets(node.string)
+        self.parseGroups(node, sorted(pairs), pairs, 0, len(node.string))
+
+
+    def parseGroups(self, node, opens, pairs, lo, hi):
+        '''Lift out the outermost bracket groups in node, whose own text spans [lo, hi) of the text
+        the brackets were matched in, and parse them and what's left.'''
+        matches = []
+        oi = bisect.bisect_left(opens, lo)
+        while oi < len(opens) and opens[oi] < hi:
+            open = opens[oi]
+            close, styles = pairs[open]
+            parseGroup = lambda child, lo=open + 1, hi=close: self.parseGroup(child, opens, pairs, lo, hi)
+            matches.append((open + 1 - lo, close - lo, styles, parseGroup))
+            oi = bisect.bisect_left(opens, close, oi)
+        spliceMatches(node, matches)
+        self.parseLevel(node)
+
+
+    def parseGroup(self, node, opens, pairs, lo, hi):
+        '''Parse the bracket group lifted out into node, which spans [lo, hi) like in parseGroups().
+        The same text always parses the same, so unless something was lifted out of it before the
+        brackets were, node shares the parse of every group with its text.'''
+        if len(node.children) > 0 or hi - lo < sharedGroupLength:
+            self.parseGroups(node, opens, pairs, lo, hi)
+            return
+
+        # keyed by a digest, since the text of a group is in the text of every group around it
+        text = node.string
+        key = (hashlib.blake2b(text.encode(), digest_size=16).digest(), self.makeOpened)
+        shared = sharedGroups.get(key)
+        if shared is None:
+            root = ModdedString(text)
+            self.parseGroups(root, opens, pairs, lo, hi)
+            shared = (root.toTuple(), len(text))
+            sharedGroups.put(key, shared)
+        node.shared = shared[0]
+
+
+    def parseLevel(self, node):
+        '''Parse the text of one bracket group, with its inner groups already lifted out, one
+        comma-separated fragment at a time.'''
+        string = node.string
+        if ',' not in string:
+            self.parseFragment(node)
+            return
+
+        matches = []
+        start = 0
+        for end in [i for i, ch in enumerate(string) if ch == ','] + [len(string)]:
+            if end > start:
+                matches.append((start, end, {}, self.parseFragment))
+            start = end + 1
+        spliceMatches(node, matches)
+
+
+    def parseFragment(self, node):
+        '''Style the keywords, types, scopes and operators in text with no brackets or commas of its
+        own. Each rule lifts out all its matches at once, in order of precedence. Lifting text out can
+        join what's left into something an earlier rule wants, so start over after a rule matches.'''
+        rules = self.fragmentRules
+        active = instrument.active
+        string = node.string
+        present = set(string)
+        ri = 0
+        while ri < len(rules):
+            name, needs, rule = rules[ri]
+            if not canMatch(needs, present):
+                if active:
+                    instrument.skip(f'rule {name}')
+                ri += 1
                 continue
 
-            if (tn := nestedString.string.find('constexpr ')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('constexpr '), Style.DIM)
-                continue
+            if active:
+                began = instrument.now()
+                matches = rule(string)
+                instrument.record(f'rule {name}', began, len(matches) > 0, False)
+            else:
+                matches = rule(string)
+            if len(matches) > 0:
+                spliceMatches(node, matches)
+                string = node.string
+                present = set(string)
+                ri = 0
+            else:
+                ri += 1
+
+
+    def keywordMatches(self, string, rule):
+        '''Lift out every one of rule's keywords in string that doesn't overlap one before it.'''
+        matches = []
+        end = 0
+        stylesOf = self.keywords.stylesOf
+        for start, keyword in self.keywords.scan(string).get(rule, ()):
+            if start >= end:
+                end = start + len(keyword)
+                matches.append((start, end, stylesOf[rule, keyword], None))
+        return matches
+
+
+    def firstKeywordMatches(self, string, rule, leaveSome=False):
+        '''Lift out every occurrence of the first of rule's keywords that string holds; if leaveSome,
+        only as long as some of the string would be left.'''
+        found = self.keywords.scan(string).get(rule)
+        if found is None:
+            return []
+        for keyword in self.keywords.order[rule]:
+            matches = []
+            end = 0
+            length = len(string)
+            styles = self.keywords.stylesOf[rule, keyword]
+            for start, foundKeyword in found:
+                if leaveSome and length <= len(keyword):
+                    break
+                if foundKeyword == keyword and start >= end:
+                    end = start + len(keyword)
+                    matches.append((start, end, styles, None))
+                    length -= len(keyword)
+            if len(matches) > 0:
+                return matches
+        return []
+
+
+    def matchKeywords(self, string):
+        return self.keywordMatches(string, 'matchKeywords')
+
+
+    def matchNoise(self, string):
+        # like the rewrite rules, try the last one first, and never lift out the whole fragment
+        matches = []
+        length = len(string)
+        for regex in (allocatorRegex, charTraitsRegex):
+            for m in reversed(list(regex.finditer(string))):
+                if m.start() > 0 or m.end() < length:
+                    matches.append((m.start(), m.end(), Style.DIM, self.parseFragment))
+                    length -= m.end() - m.start()
+            if len(matches) > 0:
+                break
+        return list(reversed(matches))
 
-            if (tn := nestedString.string.find('class ')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('class '), Style.DIM)
-                continue
 
-            if (tn := nestedString.string.find('struct ')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('struct '), Style.DIM)
-                continue
+    def matchDimKeywords(self, string):
+        return self.keywordMatches(string, 'matchDimKeywords')
 
-            match = scopedTypeRegex.search(nestedString.string)
-            if match and not nestedString.string.endswith('::'):
-                scopeStr = match.group(1)
-                typeStr = match.group(2)
 
-                newSub = nestedString.modSubstring(match.start(), match.end(), Style.TYPE)
-                newSub2 = newSub.modSubstring(0, len(scopeStr), scopeStyle)
-                rec(newSub)
-                rec(newSub2)
-                continue
+    def matchScopedTypes(self, string):
+        if string.endswith('::'):
+            return []
+        return [(m.start(), m.end(), Style.TYPE, self.scopedTypeParser(len(m.group(1))))
+                for m in scopedTypeRegex.finditer(string)]
 
-            match = templateTypeRegex.search(nestedString.string)
-            if match:
-                newSub = nestedString.modSubstring(match.start(), match.end() - 2, Style.TYPE)
-                rec(newSub)
-                continue
 
-            if (tn := nestedString.string.find('<>')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('<>'))
-                continue
+    def matchTemplateTypes(self, string):
+        return [(m.start(), m.end() - 2, Style.TYPE, self.parseFragment)
+                for m in templateTypeRegex.finditer(string)]
 
-            if (tn := nestedString.string.find('()')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('()'), [Style.PARAM, Style.OPERATOR])
-                continue
 
-            if (tn := nestedString.string.find('::type')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('::type'), [noisyStyle, Style.TYPE])
-                continue
+    def matchSequences(self, string):
+        return self.firstKeywordMatches(string, 'matchSequences')
 
-            if (tn := nestedString.string.find('::value')) >= 0:
-                newSub = nestedString.modSubstring(tn, tn + len('::value'), [noisyStyle, Style.TYPE])
-                continue
 
-            match = scopeLayerRegex.search(nestedString.string)
-            if match and match.end() - match.start() < len(nestedString.string):
-                newSub = nestedString.modSubstring(match.start(), match.end(), scopeStyle)
-                rec(newSub)
-                continue
+    def matchScopeLayers(self, string):
+        matches = []
+        length = len(string)
+        for m in scopeLayerRegex.finditer(string):
+            if m.end() - m.start() < length:
+                matches.append((m.start(), m.end(), self.scopeStyle, self.parseFragment))
+                length -= m.end() - m.start()
+        return matches
 
-            if nestedString.string.startswith('::') and len(nestedString.string) > 2:
-                newSub = nestedString.modSubstring(0, 2)
-                continue
 
-            if nestedString.string.startswith(' ') and len(nestedString.string) > 1:
-                newSub = nestedString.modSubstring(0, 1)
-                continue
+    def matchOperators(self, string):
+        # never lift out the whole fragment
+        return self.firstKeywordMatches(string, 'matchOperators', True)
 
-            if nestedString.string.endswith(' ') and len(nestedString.string) > 1:
-                newSub = nestedString.modSubstring(len(nestedString.string) - 1, len(nestedString.string))
-                continue
 
-            if nestedString.string.startswith('_') and len(nestedString.string) > 1:
-                newSub = nestedString.modSubstring(0, 1, noisyStyle)
-                continue
+    def scopedTypeParser(self, scopeLength):
+        def parseScopedType(node):
+            self.parseFragment(node.modSubstring(0, scopeLength, self.scopeStyle))
+            self.parseFragment(node)
+        return parseScopedType
 
-            if nestedString.string.endswith('_') and len(nestedString.string) > 1:
-                newSub = nestedString.modSubstring(len(nestedString.string) - 1, len(nestedString.string), noisyStyle)
-                continue
 
-            if (tn := nestedString.string.find('&&')) >= 0 and len(nestedString.string) > 2:
-                newSub = nestedString.modSubstring(tn, tn + len('&&'), Style.OPERATOR)
-                continue
+    def matchEdges(self, string):
+        '''Lift leading '::' and spaces, and leading and trailing spaces and underscores, off the ends.'''
+        leading = []
+        trailing = []
+        lo = 0
+        hi = len(string)
+        while True:
+            if string.startswith('::', lo, hi) and hi - lo > 2:
+                leading.append((lo, lo + 2, {}, None))
+                lo += 2
+            elif string.startswith(' ', lo, hi) and hi - lo > 1:
+                leading.append((lo, lo + 1, {}, None))
+                lo += 1
+            elif string.endswith(' ', lo, hi) and hi - lo > 1:
+                trailing.append((hi - 1, hi, {}, None))
+                hi -= 1
+            elif string.startswith('_', lo, hi) and hi - lo > 1:
+                leading.append((lo, lo + 1, self.noisyStyle, None))
+                lo += 1
+            elif string.endswith('_', lo, hi) and hi - lo > 1:
+                trailing.append((hi - 1, hi, self.noisyStyle, None))
+                hi -= 1
+            else:
+                break
 
-            if (tn := nestedString.string.find('&')) >= 0 and len(nestedString.string) > 1:
-                newSub = nestedString.modSubstring(tn, tn + len('&'), Style.OPERATOR)
-                continue
+        return leading + list(reversed(trailing))
+
+
+class LiftIndex:
+    '''Which characters of a ModdedString's span were lifted out into its children, for when text is
+    lifted out before children it already has. It's a Fenwick tree over the span that adds over
+    ranges, so the backing position of an own-text position, and the children inside a span, are
+    found in log time, and lifting text out never rewrites anything after it.'''
+    __slots__ = ('offset', 'size', 'top', 'adds', 'weighted', 'byStart')
+
+    def __init__(self, node):
+        self.offset = node.start
+        self.size = node.end - node.start
+        self.top = 1 << self.size.bit_length()
+        self.adds = [0] * (self.size + 1)
+        self.weighted = [0] * (self.size + 1)
+        self.byStart = {}
+        for child in node.children:
+            self.add(child, 1)
+
+
+    def addFrom(self, i, value):
+        '''Add value to the count of every character from the ith on, counting from 1.'''
+        adds = self.adds
+        weighted = self.weighted
+        weight = value * (i - 1)
+        size = self.size
+        while i <= size:
+            adds[i] += value
+            weighted[i] += weight
+            i += i & -i
+
+
+    def add(self, child, sign):
+        '''Count child's characters as lifted, or as not lifted anymore if sign is -1.'''
+        self.addFrom(child.start - self.offset + 1, sign)
+        self.addFrom(child.end - self.offset + 1, -sign)
+        if sign > 0:
+            self.byStart[child.start] = child
+        else:
+            del self.byStart[child.start]
+
+
+    def lifted(self, n):
+        '''How many of the span's first n characters are lifted.'''
+        adds = weighted = 0
+        i = n
+        while i > 0:
+            adds += self.adds[i]
+            weighted += self.weighted[i]
+            i -= i & -i
+        return adds * n - weighted
+
+
+    def backingPos(self, pos):
+        '''Where own character pos is in the backing string: after the most characters that hold no
+        more than pos own ones.'''
+        n = adds = weighted = 0
+        step = self.top
+        while step > 0:
+            i = n + step
+            if i <= self.size:
+                nextAdds = adds + self.adds[i]
+                nextWeighted = weighted + self.weighted[i]
+                if i - (nextAdds * i - nextWeighted) <= pos:
+                    n, adds, weighted = i, nextAdds, nextWeighted
+            step >>= 1
+        return self.offset + n
+
+
+    def nextLifted(self, lifted):
+        '''Where the lifted character after the first lifted ones is in the backing string.'''
+        n = adds = weighted = 0
+        step = self.top
+        while step > 0:
+            i = n + step
+            if i <= self.size:
+                nextAdds = adds + self.adds[i]
+                nextWeighted = weighted + self.weighted[i]
+                if nextAdds * i - nextWeighted <= lifted:
+                    n, adds, weighted = i, nextAdds, nextWeighted
+            step >>= 1
+        return self.offset + n
+
+
+    def ownBefore(self, backingPos):
+        '''How many own characters come before backingPos, which isn't inside a child.'''
+        n = backingPos - self.offset
+        return n - self.lifted(n)
+
+
+    def childrenIn(self, start, end):
+        '''The children inside backing span [start, end), in order; neither end is inside a child.'''
+        lifted = self.lifted(start - self.offset)
+        count = self.lifted(end - self.offset) - lifted
+        children = []
+        while count > 0:
+            child = self.byStart[self.nextLifted(lifted)]
+            children.append(child)
+            lifted += child.end - child.start
+            count -= child.end - child.start
+        return children
+
+
+# spans shorter than this walk their children to lift text out before them; longer ones index them
+indexedLength = 1024
+
+
+def spanStart(node):
+    return node.start
 
-            if (tn := nestedString.string.find('*')) >= 0 and len(nestedString.string) > 1:
-                newSub = nestedString.modSubstring(tn, tn + len('*'), Style.OPERATOR)
-                continue
 
-    ns = ModdedString(message, [], Style.HIGHLIGHT if highlighted else {})
-    rec(ns)
-    return ns
+class ModdedString:
+    '''A styled span [start, end) of a backing string, which it shares with its whole tree. Children
+    are disjoint spans inside it, in order; the node's own text is what they leave. Each child is
+    anchored at the own-text position it was lifted out of. Only the last child's anchor is kept; text
+    lifted out after it costs nothing more, and text lifted out before it goes through a LiftIndex.
+    A bracket group's node may instead have no children, and share the toTuple() of its text, parsed
+    on its own, with every group like it.'''
+    __slots__ = ('backing', 'start', 'end', 'styles', 'ordered', 'lastAnchor', 'lastEnd', 'index',
+                 'ownString', 'shared')
+
+    def __init__(self, backing, styles = {}, start = 0, end = None):
+        if not isinstance(backing, str):
+            raise RuntimeError(f'"backing" must be a string.')
+
+        self.backing = backing
+        self.start = start
+        self.end = len(backing) if end is None else end
+        self.styles = Style.keyOf(styles)
+        self.ordered = ()
+        self.lastAnchor = 0
+        self.lastEnd = start
+        self.index = None
+        self.ownString = None
+        self.shared = None
 
 
-class ModdedString:
-    def __init__(self, strings, mods = [], styles = {}):
-        cm = a.Rgb(192, 192, 192).fg()
-        cs = a.Rgb(192, 192, 92).fg()
+    @property
+    def children(self):
+        '''The children, in order; sorted again only after text was lifted out before the last one.'''
+        if self.ordered is None:
+            self.ordered = sorted(self.index.byStart.values(), key=spanStart)
+        return self.ordered
 
-        if isinstance(strings, list):
-            self.strings = strings
-        elif isinstance(strings, str):
-            self.strings = [strings]
-        else:
-            raise RuntimeError(f'"strings" must be a list of strings or a string.')
 
-        if isinstance(mods, list):
-            self.mods = mods
-        elif isinstance(mods, ModdedString):
-            self.mods = [mods]
-        else:
-            raise RuntimeError(f'"mods" must be a list of ModdedStrings or a ModdedString.')
+    @property
+    def anchors(self):
+        anchors = []
+        lifted = 0
+        for child in self.children:
+            anchors.append(child.start - self.start - lifted)
+            lifted += child.end - child.start
+        return anchors
 
-        if len(self.strings) - len(self.mods) != 1:
-            raise RuntimeError(f'There should be one more string than mod.')
 
-        self.styles = Style.normalizeStyles(styles)
+    @property
+    def strings(self):
+        '''The own text between children, one more piece than there are children.'''
+        strings = []
+        pos = self.start
+        for child in self.children:
+            strings.append(self.backing[pos:child.start])
+            pos = child.end
+        strings.append(self.backing[pos:self.end])
+        return strings
 
 
     def reprRec(self, depth = 0):
         cm = a.Rgb(192, 192, 192).fg()
         cs = a.Rgb(255, 157, 184).fg()
         src = ''
-        src += f'{cm}{"- " * depth}children: {cs}{len(self.mods)}\n'
-        src += f'{cm}{"- " * depth}styles: {cs}{"|".join([s.name for s in self.styles])}\n'
+        src += f'{cm}{"- " * depth}children: {cs}{len(self.children)}\n'
+        src += f'{cm}{"- " * depth}styles: {cs}{"|".join([s.name for s in Style.stylesOf(self.styles)])}\n'
         src += ''.join([f'{cm}{"- " * depth}\'{cs}{s}{cm}\'\n' for s in self.strings])
         src += f'{a.off}\n'
-        for n in self.mods:
+        for n in self.children:
             src += n.reprRec(depth + 1)
+        if self.shared is not None:
+            src += ModdedString.fromTuple(self.string, self.shared).reprRec(depth + 1)
 
         return src
 
@@ -433,146 +1086,479 @@ class ModdedString:
         return self.reprRec()
 
 
-    def modSubstring(self, start, end, styles={}):
-        assert(start >= 0 and start < len(self.string))
-        assert(end > 0 and end <= len(self.string) and start < end)
+    def toTuple(self):
+        '''This tree as nested tuples of plain values, without the backing string, for marshal. A
+        shared group has None for anchors, and its shared tree for children.'''
+        if self.shared is not None:
+            return (self.start, self.end, self.styles, None, self.shared)
+        return (self.start, self.end, self.styles, tuple(self.anchors),
+                tuple(child.toTuple() for child in self.children))
 
-        cm = a.Rgb(63, 63, 255).fg()
-        ch = a.Rgb(192, 143, 127).fg()
-        cs = a.Rgb(127, 255, 127).fg()
 
-        styles = Style.normalizeStyles(styles)
+    @staticmethod
+    def fromTuple(backing, tree):
+        '''The tree that toTuple() made, over the same backing string.'''
+        start, end, styles, anchors, children = tree
+        m = ModdedString(backing, {}, start, end)
+        m.styles = styles
+        if anchors is None:
+            m.shared = children
+        elif len(children) > 0:
+            m.ordered = [ModdedString.fromTuple(backing, child) for child in children]
+            m.lastAnchor = anchors[-1]
+            m.lastEnd = m.ordered[-1].end
+        return m
 
-        #printDebug (1, f'{cm}DisplaceSubStr: start: {start}; end: {end}; from: \'{cs}{self.string[0:start]}{ch}{self.string[start:end]}{cs}{self.string[end:]}{cm}\' as {"|".join([s.name for s in styles.keys()])}{a.off}')
-        #printDebug (2, f'{cm}     Top self is:\n{a.off}{self}')
-
-        removals = []
-        newStrings = []
-        newMods = []
-        totalLen = 0
-        strStart = -1
-        strEnd = -1
-        newStrL = None
-        newStrR = None
-        for i, s in enumerate(self.strings):
-            if strStart < 0 and start >= totalLen and start < totalLen + len(s):
-                strStart = i
-                newStrL = (s[:start - totalLen], s[start - totalLen : end - totalLen])
-            if end >= totalLen and end <= totalLen + len(s):
-                strEnd = i
-                if strStart == strEnd:
-                    newStrR = (0, s[end - totalLen:])
-                else:
-                    newStrR = (s[:end - totalLen], s[end - totalLen:])
-            totalLen += len(s)
-
-        assert(strStart >= 0)
-        assert(strEnd >= strStart)
-
-        for i in range(strStart, strEnd):
-            removals.append(self.mods[i])
-
-        newStrings = [newStrL[1]]
-        for i, r in enumerate(reversed(removals)):
-            if i < len(removals) - 1:
-                newStrings.append(self.strings[strStart + i + 1])
-            newMods.append(r)
-        if len(removals) > 0:
-            newStrings.append(newStrR[0])
-
-        assert(len(newStrings) - len(newMods) == 1)
-
-        newMods.reverse()
-        m = ModdedString(newStrings, newMods, styles)
-
-        if strEnd == strStart:
-            self.strings[strStart] = newStrR[1]
-            self.strings.insert(strStart, newStrL[0])
-        elif strEnd - strStart == 1:
-            self.strings[strStart] = newStrL[0]
-            self.strings[strEnd] = newStrR[1]
-        else:
-            self.strings[strStart] = newStrL[0]
-            self.strings[strEnd] = newStrR[1]
-            for i in range(strStart + 1, strEnd):
-                del self.strings[strStart + 1]
-
-        if strEnd == strStart:
-            self.mods.insert(strStart, m)
-        elif strEnd - strStart == 1:
-            self.mods[strStart] = m
-        else:
-            self.mods[strStart] = m
-            for i in range(strStart + 1, strEnd):
-                del self.mods[strStart + 1]
 
-        #printDebug (2, f'{cm}     Now self is:\n{a.off}{self}')
-        assert(len(self.strings) - len(self.mods) == 1)
+    def ownLength(self):
+        return self.lastAnchor + self.end - self.lastEnd
+
+
+    def backingPos(self, pos):
+        '''Where own-text position pos is in the backing string; children anchored at pos come before it.'''
+        if pos >= self.lastAnchor:
+            return self.lastEnd + pos - self.lastAnchor
+        if self.index is not None:
+            return self.index.backingPos(pos)
+        anchors = self.anchors
+        ci = bisect.bisect_right(anchors, pos) - 1
+        if ci < 0:
+            return self.start + pos
+        return self.children[ci].end + pos - anchors[ci]
+
+
+    def modSubstring(self, start, end, styles={}):
+        '''Lift own text [start, end) out into a new child with the given styles, and return it.
+        Children anchored at start < pos <= end go with it.'''
+        ownLength = self.ownLength()
+        assert(start >= 0 and start < ownLength)
+        assert(end > 0 and end <= ownLength and start < end)
+
+        m = ModdedString(self.backing, styles, self.backingPos(start), self.backingPos(end))
+        if start >= self.lastAnchor:
+            # after every child, as when parsers lift text out left to right
+            if self.index is not None:
+                self.index.add(m, 1)
+            if self.ordered is None:
+                pass
+            elif len(self.ordered) == 0:
+                self.ordered = [m]
+            else:
+                self.ordered.append(m)
+            self.lastAnchor = start
+            self.lastEnd = m.end
+        elif self.index is None and self.end - self.start < indexedLength:
+            # few enough children to just walk them
+            anchors = self.anchors
+            lo = bisect.bisect_right(anchors, start)
+            hi = bisect.bisect_right(anchors, end, lo)
+            if hi > lo:
+                m.ordered = self.ordered[lo:hi]
+                m.lastAnchor = anchors[hi - 1] - start
+                m.lastEnd = m.ordered[-1].end
+            self.ordered[lo:hi] = [m]
+            if hi == len(anchors):
+                self.lastAnchor = start
+                self.lastEnd = m.end
+            else:
+                self.lastAnchor -= end - start
+        else:
+            if self.index is None:
+                self.index = LiftIndex(self)
+            index = self.index
+            children = index.childrenIn(m.start, m.end)
+            if len(children) > 0:
+                m.ordered = children
+                m.lastAnchor = index.ownBefore(children[-1].start) - start
+                m.lastEnd = children[-1].end
+                for child in children:
+                    index.add(child, -1)
+            index.add(m, 1)
+            self.ordered = None
+            if m.end >= self.lastEnd:
+                self.lastAnchor = start
+                self.lastEnd = m.end
+            else:
+                self.lastAnchor -= end - start
+        self.ownString = None
 
         return m
 
 
     @property
     def string(self):
-        return ''.join(self.strings)
+        if len(self.children) == 0:
+            return self.backing[self.start:self.end]
+        if self.ownString is None:
+            self.ownString = ''.join(self.strings)
+        return self.ownString
 
 
     def render(self, styles={}):
-        src = ''
+        out = []
+        self.renderInto(out, Style.keyOf(styles))
+        return ''.join(out)
+
+
+    def renderInto(self, out, parentKey, outermost=True):
+        '''Render the tree into out. A shared group renders the same wherever its style key is the
+        same, so the outermost ones are kept rendered; the ones inside them are only in that.'''
+        key = Style.cascadeKeys(self.styles, parentKey)
+        if key & invisibleStyle:
+            return
+        if self.shared is not None:
+            out.append(self.renderShared(key, outermost))
+            return
+
+        fg, bg = Style.colorsOf(key)
+        pos = self.start
+        for m in self.children:
+            if m.start > pos:
+                out.append(fg)
+                out.append(bg)
+                out.append(self.backing[pos:m.start])
+            m.renderInto(out, key, outermost)
+            pos = m.end
+        out.append(fg)
+        out.append(bg)
+        out.append(self.backing[pos:self.end])
+
+
+    def renderShared(self, key, outermost):
+        # the root has no styles of its own: a group's come from its brackets and they cascade, so
+        # the root renders the same under the group's key as the group would
+        tree = self.shared
+        if outermost:
+            rendered = renderedGroups.get((id(tree), key))
+            if rendered is not None and rendered[0] is tree:
+                return rendered[1]
+        out = []
+        ModdedString.fromTuple(self.backing[self.start:self.end], tree).renderInto(out, key, False)
+        rendered = ''.join(out)
+        if outermost:
+            # kept with the tree, so an id reused by another tree later isn't mistaken for it
+            renderedGroups.put((id(tree), key), (tree, rendered))
+        return rendered
+
+
+class LruCache:
+    '''A dict bounded to maxSize entries, which forgets the least recently used entries to make room.
+    Given a maxWeight, the weightOf() its values are bounded to that in all too, and a value heavier
+    than that isn't kept at all.'''
+    def __init__(self, maxSize, maxWeight=None, weightOf=len):
+        self.maxSize = maxSize
+        self.maxWeight = maxWeight
+        self.weightOf = weightOf
+        self.weight = 0
+        self.entries = OrderedDict()
+
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+
+    def put(self, key, value):
+        if self.maxWeight is None:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+            return
+
+        if key in self.entries:
+            self.weight -= self.weightOf(self.entries.pop(key))
+        weight = self.weightOf(value)
+        if weight > self.maxWeight:
+            return
+        self.entries[key] = value
+        self.weight += weight
+        while len(self.entries) > self.maxSize or self.weight > self.maxWeight:
+            _, forgotten = self.entries.popitem(last=False)
+            self.weight -= self.weightOf(forgotten)
+
+
+    def clear(self):
+        self.entries.clear()
+        self.weight = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# rendered messages are many times longer than the messages, so they're bounded by length too
+renderedMessages = LruCache(4096, 1 << 25)
+# groups at least this long are shared; shorter ones are cheaper to parse again than to look up
+sharedGroupLength = 16
+# (digest of text, makeOpened): (the tree every group with that text shares, the text's length); its
+# trees take memory in proportion to their texts, and nested groups' texts overlap, so they're bounded
+sharedGroups = LruCache(1 << 16, 1 << 21, lambda shared: shared[1])
+# (id(tree), style key): (tree, what it renders to)
+renderedGroups = LruCache(4096, 1 << 24, lambda rendered: len(rendered[1]))
+# the messages sanitized so far, as their backing strings and ModdedString.toTuple()s, for the stash cache
+messageTrees = {}
+# messages shorter than this parse faster than they can be looked up
+storedTreeLength = 256
+treeStore = treecache.TreeStore(os.path.join(treecache.cacheDirectory(), 'trees.sqlite'))
+# chunks of trees the MessagePrefetcher's pool has finished, for the main thread to take into messageTrees
+prefetchedTrees = []
+
+def renderMessage(message, makeOpened, highlighted):
+    '''The rendered form of sanitizeMessage(), remembered so that template errors that repeat the same
+    huge types, and issues that didn't change between redraws, are sanitized once.'''
+    key = (message, makeOpened, highlighted)
+    rendered = renderedMessages.get(key)
+    if rendered is None:
+        while len(prefetchedTrees) > 0:
+            messageTrees.update(prefetchedTrees.pop())
+        tree = messageTrees.get(key)
+        stored = not legacySanitizer and len(message) >= storedTreeLength
+        if tree is None and stored:
+            text = parsedText(message)
+            if (storedTree := treeStore.get(text, makeOpened, highlighted)) is not None:
+                tree = messageTrees[key] = (text, storedTree)
+
+        if tree is not None:
+            backing, tree = tree
+            rendered = ModdedString.fromTuple(backing, tree).render()
+        else:
+            node = sanitizeMessage(message, makeOpened, highlighted)
+            if not legacySanitizer:
+                messageTrees[key] = (node.backing, node.toTuple())
+                if stored:
+                    treeStore.put(node.backing, makeOpened, highlighted, messageTrees[key][1])
+            rendered = node.render()
+        renderedMessages.put(key, rendered)
+    return rendered
+
+
+def makeRibbonColors():
+    return (a.Rgb(0, 31, 0).bg(), a.Rgb(0, 0, 31).bg())
+
+ribbonColors = makeRibbonColors()
+
+
+def setColored(enabled):
+    '''Make every escape geg writes empty, or not. This has to happen before anything is rendered.'''
+    global ribbonColors
+    a.setColored(enabled)
+    ribbonColors = makeRibbonColors()
+    styleColors.clear()
+
+
+class PathEntry:
+    '''A distinct file that diagnostics point at, resolved and rendered both ways.'''
+    __slots__ = ('path', 'closed', 'opened')
+
+    def __init__(self, path):
+        self.path = path
+        self.closed = sanitizePath(path, False)
+        self.opened = sanitizePath(path, True)
+
+
+class PathTable:
+    '''Interns the file names in diagnostics. Each distinct name is resolved once, with the new names
+    in a block resolved together on a thread pool, since resolve() can be slow on network mounts.
+    Names that resolve to the same file share one PathEntry.'''
+    def __init__(self):
+        self.entries = {}
+        self.entriesByPath = {}
+        self.pool = None
+
+
+    def lookup(self, file):
+        entry = self.entries.get(file)
+        if entry is None:
+            self.resolveFiles([file])
+            entry = self.entries[file]
+        return entry
+
+
+    def resolveBlock(self, block):
+        '''Resolve the files named anywhere in a block that haven't been seen yet, all at once.'''
+        files = set()
+        def collect(block):
+            for location in block.get('locations', []):
+                if (file := location.get('caret', {}).get('file')) is not None and file not in self.entries:
+                    files.add(file)
+            for chBlock in block.get('children', []):
+                collect(chBlock)
+        collect(block)
+        if len(files) > 0:
+            self.resolveFiles(list(files))
+
+
+    def resolveFiles(self, files):
+        if len(files) == 1:
+            paths = [Path(files[0]).resolve()]
+        else:
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor()
+            paths = list(self.pool.map(lambda file: Path(file).resolve(), files))
 
-        styles = Style.normalizeStyles(styles)
+        for file, path in zip(files, paths):
+            entry = self.entriesByPath.get(path)
+            if entry is None:
+                entry = PathEntry(path)
+                self.entriesByPath[path] = entry
+            self.entries[file] = entry
 
-        cascadedStyles = Style.cascadeStyles(self.styles, styles)
-        fg, bg = Style.getColors(cascadedStyles)
 
-        if Style.INVISIBLE not in cascadedStyles:
-            for s, m in zip(self.strings, self.mods):
-                if len(s) > 0:
-                    src += f'{fg}{bg}{s}'
-                src += m.render(cascadedStyles)
-            src += f'{fg}{bg}{self.strings[-1]}'
+paths = PathTable()
 
-        return src
+
+def forgetCaches():
+    '''Empty every cache of parses, renderings, styles and paths, as if nothing had been read yet.'''
+    global paths
+    renderedMessages.clear()
+    sharedGroups.clear()
+    renderedGroups.clear()
+    messageTrees.clear()
+    styleColors.clear()
+    paths = PathTable()
+
+
+def locationOf(block):
+    '''The PathEntry and line a diagnostic block points at.'''
+    locations = block.get('locations', [])
+    if len(locations) == 0:
+        # fatal errors like a missing source file have no location
+        return None, None
+    caret = locations[0]['caret']
+    return paths.lookup(caret['file']), caret['line']
 
 
-class Counter:
-    def __init__(self, count=0):
-        self.count = count
+def blockDedupKey(block):
+    '''Like Issue.dedupKey, for a block that hasn't been made into an Issue.'''
+    path, line = locationOf(block)
+    shape = hash(tuple(blockDedupKey(chBlock) for chBlock in block.get('children', [])))
+    return (block['kind'], path, line, normalizeMessage(block['message']), shape)
 
-    def inc(self):
-        self.count += 1
+
+# Issue.unbuiltToggles bits
+issueToggle = 1
+pathToggle = 2
+messageToggle = 4
 
 
 class Issue:
-    def __init__(self, issueBlock):
+    '''One diagnostic. The children and notes under it stay raw JSON blocks until they're first
+    shown, since template errors can carry thousands of notes nobody opens.'''
+    __slots__ = ('kind', 'path', 'line', 'message', 'depth', 'topIndex', 'childBlocks', 'noteBlocks', 'subs',
+                 'issueOpened', 'pathOpened', 'messageOpened', 'unbuiltToggles', 'occurrences', 'sources',
+                 'dirty', 'lineCache', 'messageCache', 'blockLoader')
+
+    def __init__(self, issueBlock, depth=0):
         self.kind = issueBlock['kind']
-        self.path = Path(issueBlock['locations'][0]['caret']['file']).resolve()
-        self.line = issueBlock['locations'][0]['caret']['line']
-        self.children = [Issue(chBlock) for chBlock in issueBlock.get('children', [])]
-        self.notes = []
+        self.path, self.line = locationOf(issueBlock)
+        self.depth = depth
+        self.topIndex = 0
+        self.childBlocks = issueBlock.get('children', [])
+        self.noteBlocks = []
+        self.subs = None
         self.message = issueBlock['message']
         self.issueOpened = False
         self.pathOpened = False
         self.messageOpened = False
+        # the toggle-alls that the issues not built yet under this one have to catch up on
+        self.unbuiltToggles = 0
+        self.occurrences = 1
+        self.sources = [issueBlock['geg-tu']] if 'geg-tu' in issueBlock else []
+        self.dirty = True
+        self.lineCache = None
+        self.messageCache = None
+        # fetches the children and notes of an issue from the stash cache, until they're needed
+        self.blockLoader = None
+
+
+    @classmethod
+    def fromRecord(cls, kind, path, line, message, occurrences, sources, blockLoader):
+        '''A top-level issue, as it was kept in the stash cache.'''
+        issue = cls({'kind': kind, 'message': message})
+        issue.path, issue.line = path, line
+        issue.occurrences = occurrences
+        issue.sources = list(sources)
+        issue.blockLoader = blockLoader
+        return issue
+
+
+    def loadBlocks(self):
+        if self.blockLoader is not None:
+            self.childBlocks, self.noteBlocks = self.blockLoader()
+            self.blockLoader = None
 
 
     def addNote(self, noteBlock):
-        self.notes.append(Issue(noteBlock))
+        self.loadBlocks()
+        self.noteBlocks.append(noteBlock)
+        if self.subs is not None:
+            self.subs.append(self.makeSubIssue(noteBlock))
 
 
-    def render(self, issueCounter, pathCounter, topIssueCounter, depth=0):
-        termWidth, _ = shutil.get_terminal_size((80, 20))
+    def subIssues(self):
+        '''The children, then the notes, under this issue.'''
+        if self.subs is None:
+            self.loadBlocks()
+            self.subs = [self.makeSubIssue(block) for block in self.childBlocks + self.noteBlocks]
+        return self.subs
+
+
+    def makeSubIssue(self, block):
+        sub = Issue(block, self.depth + 1)
+        sub.topIndex = self.topIndex
+        sub.issueOpened = bool(self.unbuiltToggles & issueToggle)
+        sub.pathOpened = bool(self.unbuiltToggles & pathToggle)
+        sub.messageOpened = bool(self.unbuiltToggles & messageToggle)
+        sub.unbuiltToggles = self.unbuiltToggles
+        return sub
+
+
+    def dedupKey(self):
+        '''Identifies an issue by what it says and where, and by the shape of everything under it.'''
+        self.loadBlocks()
+        shape = hash(tuple(blockDedupKey(block) for block in self.childBlocks + self.noteBlocks))
+        return (self.kind, self.path, self.line, normalizeMessage(self.message), shape)
 
-        src = ''
 
-        if depth == 0:
-            topIssueCounter.inc()
+    def canOpen(self):
+        if self.blockLoader is not None:
+            return True
+        return len(self.noteBlocks) + len(self.childBlocks) > 0
 
-        bgColor = f'{a.Rgb(0, 31, 0).bg() if topIssueCounter.count % 2 == 1 else a.Rgb(0, 0, 31).bg()}'
 
-        if len(self.notes) + len(self.children) > 0:
-            issueCounter.inc()
-            src += f'{bgColor}{issueCounter.count:}: {"-" if self.issueOpened else "+"}{a.off} '
+    def setTopIndex(self, topIndex):
+        '''Note which top-level issue this is, or is under, which picks its ribbon color.'''
+        self.topIndex = topIndex
+        for sub in self.subs or []:
+            sub.setTopIndex(topIndex)
+
+
+    def collectRows(self, rows):
+        '''Append this issue, and everything shown under it, to rows.'''
+        rows.append(self)
+        if self.issueOpened:
+            for sub in self.subIssues():
+                sub.collectRows(rows)
+
+
+    def renderRow(self, issueNumber, pathNumber, termWidth, bgColor):
+        '''Render this issue's own lines, as they were last time unless something has changed.'''
+        key = (termWidth, bgColor, issueNumber, pathNumber)
+        if self.dirty or self.lineCache is None or self.lineCache[0] != key:
+            self.lineCache = (key, self.renderLines(issueNumber, pathNumber, self.depth, termWidth, bgColor))
+            self.dirty = False
+        return self.lineCache[1]
+
+
+    def renderLines(self, issueNumber, pathNumber, depth, termWidth, bgColor):
+        '''Render this issue's own lines, without its children and notes.'''
+        src = ''
+
+        if self.canOpen():
+            src += f'{bgColor}{issueNumber:}: {"-" if self.issueOpened else "+"}{a.off} '
         else:
             src += f'{bgColor}    {a.off} '
 
@@ -583,100 +1569,80 @@ class Issue:
         if self.kind == 'note':
             src += f'{a.Rgb(0, 255, 255).fg()}Note: '
 
-        pathCounter.inc()
         if self.pathOpened:
             src += f'{a.Rgb(255, 255, 255).fg()}'
         else:
             src += f'{a.Rgb(127, 127, 127).fg()}'
-        src += f'{" " if depth > 0 else ""}{a.Rgb(31, 255, 255).dim().fg()}p{pathCounter.count}:{" " if depth == 0 else ""} '
-        src += f'{sanitizePath(self.path, self.pathOpened)}'
-        src += f' {a.Rgb(0, 127, 127).fg()}({self.line}): '
+        src += f'{" " if depth > 0 else ""}{a.Rgb(31, 255, 255).dim().fg()}p{pathNumber}:{" " if depth == 0 else ""} '
+        if self.path is not None:
+            src += f'{self.path.opened if self.pathOpened else self.path.closed}'
+            src += f' {a.Rgb(0, 127, 127).fg()}({self.line}): '
+
+        if self.occurrences > 1:
+            src += f'{a.Rgb(191, 63, 255).fg()}x{self.occurrences} '
 
         if self.messageOpened:
             src += f'{a.Rgb(255, 255, 255).fg()}'
         else:
             src += f'{a.Rgb(127, 127, 127).fg()}'
-        src += f'm{pathCounter.count}: '
+        src += f'm{pathNumber}: '
 
-        msg = sanitizeMessage(self.message, self.messageOpened, depth == 0 and self.issueOpened)
-        msg = justifyMessage(msg.render(), len(strNoColor(src)), termWidth, bgColor)
-        src += f'{msg}'
+        # renumbering only moves the message if the numbers grow a digit
+        messageKey = (len(strNoColor(src)), termWidth, bgColor)
+        if self.messageCache is None or self.messageCache[0] != messageKey:
+            msg = renderMessage(self.message, self.messageOpened, depth == 0 and self.issueOpened)
+            self.messageCache = (messageKey, justifyMessage(msg, messageKey[0], termWidth, bgColor))
+        src += f'{self.messageCache[1]}'
 
         src += f'{a.off}\n'
 
-        if self.issueOpened:
-            for ch in self.children:
-                src += ch.render(issueCounter, pathCounter, topIssueCounter, depth + 1)
-            for note in self.notes:
-                src += note.render(issueCounter, pathCounter, topIssueCounter, depth + 1)
+        if self.pathOpened and len(self.sources) > 0:
+            tus = justifyMessage(f'{a.Rgb(127, 127, 127).fg()}from {", ".join(self.sources)}', 6, termWidth, bgColor)
+            src += f'{bgColor}    {a.off}  {tus}{a.off}\n'
 
         return src
 
 
-    def toggleIssue(self, counter, target):
-        if len(self.notes) + len(self.children) > 0:
-            counter.inc()
-            if counter.count == target:
-                self.issueOpened = not self.issueOpened
-        else:
-            if self.issueOpened:
-                for ch in self.children:
-                    ch.toggleIssue(counter, target)
-                for note in self.notes:
-                    note.toggleIssue(counter, target)
+    def markDirty(self):
+        '''Forget this issue's rendering, after something it shows has changed.'''
+        self.dirty = True
+        self.messageCache = None
 
 
     def toggleAllIssues(self):
         self.issueOpened = not self.issueOpened
-        for ch in self.children:
-            ch.toggleAllIssues()
-        for note in self.notes:
-            note.toggleAllIssues()
-
-
-    def togglePath(self, counter, target):
-        counter.inc()
-        if counter.count == target:
-            self.pathOpened = not self.pathOpened
+        self.markDirty()
+        if self.subs is None:
+            self.unbuiltToggles ^= issueToggle
         else:
-            if self.issueOpened:
-                for ch in self.children:
-                    ch.togglePath(counter, target)
-                for note in self.notes:
-                    note.togglePath(counter, target)
+            for sub in self.subs:
+                sub.toggleAllIssues()
 
 
     def toggleAllPaths(self):
         self.pathOpened = not self.pathOpened
-        for ch in self.children:
-            ch.toggleAllPaths()
-        for note in self.notes:
-            note.toggleAllPaths()
-
-
-    def toggleMessage(self, counter, target):
-        counter.inc()
-        if counter.count == target:
-            self.messageOpened = not self.messageOpened
+        self.markDirty()
+        if self.subs is None:
+            self.unbuiltToggles ^= pathToggle
         else:
-            if self.issueOpened:
-                for ch in self.children:
-                    ch.toggleMessage(counter, target)
-                for note in self.notes:
-                    note.toggleMessage(counter, target)
+            for sub in self.subs:
+                sub.toggleAllPaths()
 
 
     def toggleAllMessages(self):
         self.messageOpened = not self.messageOpened
-        for ch in self.children:
-            ch.toggleAllMessages()
-        for note in self.notes:
-            note.toggleAllMessages()
+        self.markDirty()
+        if self.subs is None:
+            self.unbuiltToggles ^= messageToggle
+        else:
+            for sub in self.subs:
+                sub.toggleAllMessages()
 
 
     def __str__(self):
-        counter = 0
-        return self.render(0)
+        rows = RowIndex()
+        rows.add(self)
+        return rows.render()
 
 
 def printDivision():
@@ -692,56 +1658,641 @@ def printDivision():
     print (a.off)
 
 
-def main():
-    #src = sys.stdin.read()
-    #if len(src) == 0:
-    #    return
+class RowIndex:
+    '''Numbers the rows of some issues. Every issue shown, top-level or under an opened one, is a row:
+    its path number is its row number, and its issue number is its place among the rows that can be
+    opened, both counted on from the rows before these, if they were let go. Each row keeps how many
+    openable rows are before it, and each openable row where it is, so the one is found from the other
+    directly. Opening or closing an issue splices the rows under it in or out.'''
+    def __init__(self):
+        self.rows = []
+        # for each row, how many rows before it can be opened
+        self.openableBefore = []
+        # for each row that can be opened, its row index
+        self.openable = []
+        self.tops = 0
+        self.pathsBefore = 0
+        self.issuesBefore = 0
+
+
+    def indexRows(self, rows, rowIndex, issueNumber):
+        '''The openableBefore and openable entries of rows, were they put at rowIndex, with issueNumber
+        rows that can be opened before them.'''
+        openableBefore = []
+        openable = []
+        for row in rows:
+            openableBefore.append(issueNumber)
+            if row.canOpen():
+                openable.append(rowIndex)
+                issueNumber += 1
+            rowIndex += 1
+        return openableBefore, openable
+
+
+    def add(self, issue):
+        '''Add a top-level issue, and the rows shown under it.'''
+        issue.setTopIndex(self.tops)
+        self.tops += 1
+        rows = []
+        issue.collectRows(rows)
+        openableBefore, openable = self.indexRows(rows, len(self.rows), len(self.openable))
+        self.rows.extend(rows)
+        self.openableBefore.extend(openableBefore)
+        self.openable.extend(openable)
+
+
+    def rebuild(self, issues):
+        '''Renumber everything, after toggling all the issues at once.'''
+        self.rows = []
+        for issue in issues:
+            issue.collectRows(self.rows)
+        self.openableBefore, self.openable = self.indexRows(self.rows, 0, 0)
+
+
+    def letGo(self):
+        '''Forget the rows, numbering the next ones on from them.'''
+        self.pathsBefore += len(self.rows)
+        self.issuesBefore += len(self.openable)
+        self.rows = []
+        self.openableBefore = []
+        self.openable = []
+
+
+    def toggle(self, issueNumber):
+        '''Open or close the issue numbered issueNumber, and renumber the rows after it.'''
+        if not 0 < issueNumber <= len(self.openable):
+            return
+        rowIndex = self.openable[issueNumber - 1]
+        issue = self.rows[rowIndex]
+        below = []
+        for sub in issue.subIssues():
+            sub.collectRows(below)
+        openableBefore, openable = self.indexRows(below, rowIndex + 1, issueNumber)
+        rowsAfter = rowIndex + 1 + len(below)
+        openableAfter = issueNumber + len(openable)
+
+        if issue.issueOpened:
+            del self.rows[rowIndex + 1 : rowsAfter]
+            del self.openableBefore[rowIndex + 1 : rowsAfter]
+            del self.openable[issueNumber : openableAfter]
+            self.openableBefore[rowIndex + 1 :] = [n - len(openable) for n in self.openableBefore[rowIndex + 1 :]]
+            self.openable[issueNumber :] = [n - len(below) for n in self.openable[issueNumber :]]
+        else:
+            self.rows[rowIndex + 1 : rowIndex + 1] = below
+            self.openableBefore[rowIndex + 1 : rowIndex + 1] = openableBefore
+            self.openable[issueNumber : issueNumber] = openable
+            self.openableBefore[rowsAfter :] = [n + len(openable) for n in self.openableBefore[rowsAfter :]]
+            self.openable[openableAfter :] = [n + len(below) for n in self.openable[openableAfter :]]
+        issue.issueOpened = not issue.issueOpened
+        issue.markDirty()
 
-    src = ''
-    go = True
 
-    if not os.path.exists(compileErrorsPath):
-        return 0
+    def issueNumberOf(self, rowIndex):
+        '''The issue number of the row, if it can be opened; otherwise that of the last row before it that can.'''
+        issueNumber = self.issuesBefore + self.openableBefore[rowIndex]
+        return issueNumber + 1 if self.rows[rowIndex].canOpen() else issueNumber
 
-    f = open(compileErrorsPath)
-    src = f.read()
 
-    endl = '\n'
+    def renderRow(self, rowIndex, termWidth):
+        issue = self.rows[rowIndex]
+        return issue.renderRow(self.issueNumberOf(rowIndex), self.pathsBefore + rowIndex + 1, termWidth,
+                               ribbonColors[issue.topIndex % 2])
 
-    stuff = ",".join([f"{s}" for s in src.strip().split(endl) if len(s) > 0])
 
-    fsrc = f'[{stuff}]'
+    def render(self, termWidth=None):
+        '''Render every row.'''
+        if termWidth is None:
+            termWidth, _ = shutil.get_terminal_size((80, 20))
+        return ''.join(self.renderRow(rowIndex, termWidth) for rowIndex in range(len(self.rows)))
 
-    try:
-        issuesSrc = json.loads(fsrc)
-    except:
-        print(fsrc)
-        quit()
-
-    issues = []
-
-    for issueSrcList in issuesSrc:
-        for issueSrc in issueSrcList:
-            kind = issueSrc['kind']
-            if kind == 'error' or kind == 'warning':
-                issues.append(Issue(issueSrc))
-            elif kind == 'note':
-                issues[-1].addNote(issueSrc)
-            else:
-                issues.append(Issue(issueSrc))
 
-    running = len(issues) > 0
-    while running:
-        ec = Counter()
-        pc = Counter()
-        tc = Counter()
+class IssueView:
+    '''Shows the issues a screenful at a time, numbered by a RowIndex.'''
+    def __init__(self):
+        self.issues = []
+        self.index = RowIndex()
+        self.top = 0
+        self.bottom = 0
+        self.linesUsed = 0
+        self.full = False
+
+
+    @property
+    def rows(self):
+        return self.index.rows
+
+
+    def add(self, issue):
+        self.issues.append(issue)
+        self.index.add(issue)
+
+
+    def rebuild(self):
+        '''Renumber everything, after toggling all the issues at once.'''
+        self.index.rebuild(self.issues)
+        self.top = min(self.top, len(self.rows) - 1)
+
+
+    def toggleIssue(self, issueNumber):
+        self.index.toggle(issueNumber)
+
+
+    def togglePath(self, pathNumber):
+        if 0 < pathNumber <= len(self.rows):
+            issue = self.rows[pathNumber - 1]
+            issue.pathOpened = not issue.pathOpened
+            issue.markDirty()
+
+
+    def toggleMessage(self, pathNumber):
+        if 0 < pathNumber <= len(self.rows):
+            issue = self.rows[pathNumber - 1]
+            issue.messageOpened = not issue.messageOpened
+            issue.markDirty()
+
+
+    def screenSize(self):
+        termWidth, termHeight = shutil.get_terminal_size((80, 20))
+        # leave room for the division, the status line and the prompt
+        return termWidth, max(termHeight - 3, 1)
+
+
+    def draw(self):
         printDivision()
-        for iss in issues:
-            print (iss.render(ec, pc, tc), end='')
+        self.top = max(0, min(self.top, len(self.rows) - 1))
+        self.bottom = self.top
+        self.linesUsed = 0
+        self.full = False
+        self.drawMore()
+        self.printStatus()
+
+
+    def prefetchSteps(self):
+        '''Render what the likely next commands will show, yielding after each piece: the next
+        screenful, then each shown message opened or closed, then each shown issue highlighted and
+        what it would show under it when opened. Paths toggle cheaply already, since PathTable has
+        them rendered both ways.'''
+        termWidth, height = self.screenSize()
+        prefetched = 0
+        for rowIndex in range(self.bottom, len(self.rows)):
+            prefetched += self.index.renderRow(rowIndex, termWidth).count('\n')
+            yield
+            if prefetched > height:
+                break
+
+        shown = self.rows[self.top : self.bottom]
+        for issue in shown:
+            renderMessage(issue.message, not issue.messageOpened, issue.depth == 0 and issue.issueOpened)
+            yield
+
+        for issue in shown:
+            if not issue.canOpen() or issue.issueOpened:
+                continue
+            if issue.depth == 0:
+                renderMessage(issue.message, issue.messageOpened, True)
+                yield
+            for sub in issue.subIssues()[:height]:
+                renderMessage(sub.message, sub.messageOpened, False)
+                yield
+
+
+    def drawMore(self):
+        '''Print the rows after the last one printed, while they fit on the screen.'''
+        if self.full:
+            return
+        termWidth, height = self.screenSize()
+        pieces = []
+        while self.bottom < len(self.rows):
+            src = self.index.renderRow(self.bottom, termWidth)
+            if self.linesUsed > 0 and self.linesUsed + src.count('\n') > height:
+                self.full = True
+                break
+            pieces.append(src)
+            self.linesUsed += src.count('\n')
+            self.bottom += 1
+        print (''.join(pieces), end='', flush=True)
+
+
+    def printStatus(self):
+        if self.top > 0 or self.bottom < len(self.rows):
+            printText(f'paths {self.top + 1}-{self.bottom} of {len(self.rows)}; '
+                      f'"n" for the next page, "b" for the previous one, "g" and a path number to go there')
+
+
+    def nextPage(self):
+        if self.bottom < len(self.rows):
+            self.top = max(self.bottom, self.top + 1)
+
+
+    def previousPage(self):
+        termWidth, height = self.screenSize()
+        linesUsed = 0
+        top = self.top
+        while top > 0:
+            src = self.index.renderRow(top - 1, termWidth)
+            linesUsed += src.count('\n')
+            if linesUsed > height and top < self.top:
+                break
+            top -= 1
+        self.top = top
+
+
+    def goToPath(self, pathNumber):
+        self.top = max(0, min(pathNumber, len(self.rows)) - 1)
+
+
+def readDiagnosticBlocks(stream, chunkSize=1 << 16, onText=None):
+    '''Yield each diagnostic block from a stream of concatenated JSON documents, as soon as it is
+    decoded. Top-level arrays are unrolled, so only one block's text is held at a time. Lines that
+    aren't JSON, like a linker's complaints, are passed to onText; so are lines that only start like
+    JSON, like the assembler's '{standard input}: Assembler messages:' or make's '[ 50%] Building'.'''
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    inArray = False
+    readSize = chunkSize
+
+    def readMore():
+        nonlocal buf, pos, readSize
+        chunk = stream.readline(readSize)
+        if len(chunk) == 0:
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (inArray and buf[pos] == ',')):
+            pos += 1
+
+        if pos == len(buf):
+            if not readMore():
+                break
+            continue
+
+        ch = buf[pos]
+        isText = not inArray and ch not in '[{'
+        if not inArray and ch == '[':
+            # an array of blocks holds nothing but blocks
+            first = pos + 1
+            while first < len(buf) and buf[first].isspace():
+                first += 1
+            if first == len(buf):
+                if readMore():
+                    continue
+            elif buf[first] in '{]':
+                inArray = True
+                pos += 1
+                continue
+            isText = True
+
+        if isText:
+            eol = buf.find('\n', pos)
+            if eol < 0:
+                if readMore():
+                    continue
+                eol = len(buf)
+            if onText is not None:
+                onText(buf[pos:eol])
+            pos = min(eol + 1, len(buf))
+            continue
+
+        if inArray and ch == ']':
+            inArray = False
+            pos += 1
+            continue
+
+        try:
+            block, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            eol = buf.find('\n', pos)
+            if not inArray and 0 <= e.pos < eol:
+                # the line is all here, and isn't JSON
+                if onText is not None:
+                    onText(buf[pos:eol])
+                pos = eol + 1
+                continue
+            # likely a block split across reads; grow the reads so huge blocks aren't rescanned often
+            readSize = max(readSize, len(buf) - pos)
+            if readMore():
+                continue
+            raise
+
+        pos = end
+        readSize = chunkSize
+        yield block
+
+
+def absolutizeLocations(block, directory):
+    '''Make a block's file paths absolute, since each compile command runs in its own directory.'''
+    for location in block.get('locations', []):
+        for point in location.values():
+            if isinstance(point, dict) and 'file' in point:
+                point['file'] = os.path.join(directory, point['file'])
+    for chBlock in block.get('children', []):
+        absolutizeLocations(chBlock, directory)
+
+
+def driveBuild(buildDriver, stashPath, onText):
+    '''Yield the diagnostic blocks of every TU the driver compiles, in compile-command order. Each
+    TU's blocks are stashed as one line, like a wrapped compiler's would be.'''
+    with open(stashPath, 'w') as sink:
+        for command, stderr in buildDriver.results():
+            tuBlocks = []
+            for block in readDiagnosticBlocks(io.StringIO(stderr), onText=onText):
+                absolutizeLocations(block, command.directory)
+                block['geg-tu'] = command.file
+                tuBlocks.append(block)
+
+            if len(tuBlocks) > 0:
+                sink.write(json.dumps(tuBlocks) + '\n')
+                sink.flush()
+            yield from tuBlocks
+
+
+def tagBlocks(blocks, tu):
+    '''Mark each block with the TU it came from.'''
+    for block in blocks:
+        block.setdefault('geg-tu', tu)
+        yield block
+
+
+def buildIssues(blocks):
+    '''Yield each top-level Issue as soon as it is complete, which is when the next non-note block arrives.'''
+    issue = None
+    for block in blocks:
+        paths.resolveBlock(block)
+        if block['kind'] == 'note' and issue is not None:
+            issue.addNote(block)
+            continue
+
+        if issue is not None:
+            yield issue
+        issue = Issue(block)
+
+    if issue is not None:
+        yield issue
+
+
+class DedupIndex:
+    '''Folds repeated issues, like a header's error reported by every TU that includes it, into the
+    first one seen, which counts the repeats and keeps the TUs they came from.'''
+    def __init__(self):
+        self.issues = {}
+
+
+    def add(self, issue):
+        '''Returns the issue if it's new, or None if it was folded into an earlier one.'''
+        key = issue.dedupKey()
+        first = self.issues.get(key)
+        if first is None:
+            self.issues[key] = issue
+            return issue
+
+        first.occurrences += issue.occurrences
+        for source in issue.sources:
+            if source not in first.sources:
+                first.sources.append(source)
+        first.markDirty()
+        return None
+
+
+def uniqueIssues(issues):
+    '''Yield only the issues that aren't repeats of earlier ones, remembering just digests of their
+    keys, for when the issues aren't kept to count their repeats in.'''
+    seen = set()
+    for issue in issues:
+        key = hashlib.blake2b(repr(issue.dedupKey()).encode(), digest_size=16).digest()
+        if key not in seen:
+            seen.add(key)
+            yield issue
+
+
+def dedupIssues(issues, index=None):
+    '''Yield only the issues that aren't repeats of earlier ones.'''
+    if index is None:
+        index = DedupIndex()
+    for issue in issues:
+        if index.add(issue) is not None:
+            yield issue
+
+
+# less message text than this parses faster than a process pool starts
+prefetchMinLength = 1 << 18
+prefetchChunkLength = 1 << 15
+
+def sanitizeChunk(keys):
+    '''Parse a chunk of renderMessage() keys, in a pool process.'''
+    trees = []
+    for key in keys:
+        node = sanitizeMessage(*key)
+        trees.append((key, (node.backing, node.toTuple())))
+    return trees
+
+
+class MessagePrefetcher:
+    '''Parses the messages of every issue, both opened and closed, on a process pool once they've all
+    been read, so they're ready by the time they're shown. The top-level messages go first, then those
+    under the issues whose blocks are in memory already; the rest are loaded and parsed when they're
+    opened. A thread does the collecting and submitting, so the prompt doesn't wait for it. Each
+    chunk's trees land in prefetchedTrees as it finishes; a message shown before then is parsed on the
+    spot, as usual. A small load, or a single core, isn't worth starting a pool for, so its messages
+    are all just parsed as they're shown.'''
+    def __init__(self, issues):
+        self.pool = None
+        self.closed = False
+        self.lock = threading.Lock()
+        if legacySanitizer or (os.cpu_count() or 1) < 2:
+            return
+        threading.Thread(target=self.submitAll, args=(issues,), daemon=True).start()
+
+
+    def collectKeys(self, issues):
+        keys = {}
+        def collect(message, topLevel):
+            for makeOpened in (False, True):
+                for highlighted in ((False, True) if topLevel else (False,)):
+                    key = (message, makeOpened, highlighted)
+                    if key not in messageTrees:
+                        keys[key] = len(message)
+
+        def collectBlock(block):
+            collect(block['message'], False)
+            for chBlock in block.get('children', []):
+                collectBlock(chBlock)
+
+        for issue in issues:
+            collect(issue.message, True)
+        for issue in issues:
+            if issue.blockLoader is None:
+                for block in issue.childBlocks + issue.noteBlocks:
+                    collectBlock(block)
+        return keys
+
+
+    def submitAll(self, issues):
+        keys = self.collectKeys(issues)
+        if sum(keys.values()) < prefetchMinLength:
+            return
+
+        chunk = []
+        chunkLength = 0
+        for key, length in keys.items():
+            chunk.append(key)
+            chunkLength += length
+            if chunkLength >= prefetchChunkLength:
+                if not self.submit(chunk):
+                    return
+                chunk = []
+                chunkLength = 0
+        if len(chunk) > 0:
+            self.submit(chunk)
+
+
+    def submit(self, chunk):
+        '''Queue a chunk on the pool, starting it if need be, unless the prefetcher was closed.'''
+        with self.lock:
+            if self.closed:
+                return False
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(initializer=elision.setRules, initargs=(elision.patterns,))
+            self.pool.apply_async(sanitizeChunk, (chunk,), callback=prefetchedTrees.append)
+            return True
+
+
+    def close(self):
+        '''Stop the pool, dropping what it's on and what's queued.'''
+        with self.lock:
+            self.closed = True
+            if self.pool is not None:
+                self.pool.terminate()
+                self.pool = None
+
+
+def issueRecord(issue):
+    '''How a top-level issue is kept in the stash cache.'''
+    blocks = None
+    if issue.canOpen():
+        issue.loadBlocks()
+        blocks = (issue.childBlocks, issue.noteBlocks)
+    file = None if issue.path is None else str(issue.path.path)
+    return (issue.kind, file, issue.line, issue.message, issue.occurrences, issue.sources, blocks)
+
+
+def replayStashCache(cache, onText):
+    '''Yield the issues kept in a stash cache, and pass its lines of text to onText, in the order they
+    were first shown.'''
+    files = {record[1] for record in cache.records if not isinstance(record, str) and record[1] is not None}
+    unresolved = [file for file in files if file not in paths.entries]
+    if len(unresolved) > 0:
+        paths.resolveFiles(unresolved)
+
+    for record in cache.records:
+        if isinstance(record, str):
+            onText(record)
+            continue
+        kind, file, line, message, occurrences, sources, offset, length = record
+        blockLoader = functools.partial(cache.blocks, offset, length) if length > 0 else None
+        path = None if file is None else paths.lookup(file)
+        yield Issue.fromRecord(kind, path, line, message, occurrences, sources, blockLoader)
+
+
+def printText(text, file=None):
+    print (f'{a.Rgb(127, 127, 127).fg()}{text}{a.off}', file=file)
+
+
+class BatchWriter:
+    '''Writes each issue to a stream as soon as it's built, numbered the way the interactive view
+    would number them, for logs rather than people. Nothing is kept once it's written.'''
+    def __init__(self, out, termWidth=None):
+        self.out = out
+        self.termWidth = termWidth
+        self.rows = RowIndex()
+
+
+    def write(self, issue):
+        self.rows.add(issue)
+        self.out.write(self.rows.render(self.termWidth))
+        self.out.flush()
+        self.rows.letGo()
+        # nothing is shown twice, so there's no use keeping its parse or rendering, and what's kept
+        # for other issues would only grow with the build
+        messageTrees.clear()
+        renderedMessages.clear()
+        sharedGroups.clear()
+        renderedGroups.clear()
+        treeStore.flush()
+
+
+class CommandReader:
+    '''Reads command lines from a stream, without holding up the event loop while there isn't one.
+    A stream that can't be waited on, like a redirected file, is read on a thread instead.'''
+    def __init__(self, stream):
+        self.stream = stream
+        self.loop = asyncio.get_running_loop()
+        self.lines = asyncio.Queue()
+        self.partial = ''
+        self.decoder = codecs.getincrementaldecoder(stream.encoding or 'utf-8')(errors='replace')
+        try:
+            self.fd = stream.fileno()
+            self.loop.add_reader(self.fd, self.onReadable)
+        except (OSError, ValueError, io.UnsupportedOperation):
+            self.fd = None
+
+
+    def onReadable(self):
+        data = os.read(self.fd, 1 << 16)
+        text = self.decoder.decode(data, final=len(data) == 0)
+        *lines, self.partial = (self.partial + text).split('\n')
+        for line in lines:
+            self.lines.put_nowait(line)
+        if len(data) == 0:
+            if len(self.partial) > 0:
+                self.lines.put_nowait(self.partial)
+            self.lines.put_nowait(None)
+            self.close()
+
+
+    async def readLine(self):
+        '''The next line, without its newline, or None at the end of the stream.'''
+        if self.fd is None:
+            line = await self.loop.run_in_executor(None, self.stream.readline)
+            return line.rstrip('\n') if len(line) > 0 else None
+        return await self.lines.get()
+
+
+    def close(self):
+        if self.fd is not None:
+            self.loop.remove_reader(self.fd)
+
+
+async def prefetchIdly(view):
+    '''Do the view's prefetching a bit at a time, so a command can cut in.'''
+    for _ in view.prefetchSteps():
+        await asyncio.sleep(0)
+
+
+async def interact(view):
+    '''Take commands until "q", redrawing after each one.'''
+    issues = view.issues
+    reader = CommandReader(sys.stdin)
+    running = True
+    drawn = True
+    while running:
+        if not drawn:
+            view.draw()
+        drawn = False
 
+        # work out what the next command will likely show, until there is one
+        prefetching = asyncio.create_task(prefetchIdly(view))
         command = ''
         while True:
-            command = input(f'{a.off}Command? ').strip()
+            print (f'{a.off}Command? ', end='', flush=True)
+            command = await reader.readLine()
+            if command is None:
+                running = False
+                break
+            command = command.strip()
 
             if len(command) == 0:
                 continue
@@ -753,16 +2304,26 @@ def main():
                 running = False
                 break
 
+            elif command == 'n':
+                view.nextPage()
+                break
+
+            elif command == 'b':
+                view.previousPage()
+                break
+
+            elif command[0] == 'g' and str.isdigit(command[1:]):
+                view.goToPath(int(command[1:]))
+                break
+
             elif command == '*':
                 for iss in issues:
                     iss.toggleAllIssues()
+                view.rebuild()
                 break
 
             elif str.isdigit(command):
-                n = int(command)
-                ec = Counter()
-                for iss in issues:
-                    iss.toggleIssue(ec, n)
+                view.toggleIssue(int(command))
                 break
 
             elif command[0] == 'p':
@@ -770,10 +2331,7 @@ def main():
                     for iss in issues:
                         iss.toggleAllPaths()
                 elif str.isdigit(command[1:]):
-                    n = int(command[1:])
-                    pc = Counter()
-                    for iss in issues:
-                        iss.togglePath(pc, n)
+                    view.togglePath(int(command[1:]))
                 break
 
             elif command[0] == 'm':
@@ -781,10 +2339,7 @@ def main():
                     for iss in issues:
                         iss.toggleAllMessages()
                 elif str.isdigit(command[1:]):
-                    n = int(command[1:])
-                    pc = Counter()
-                    for iss in issues:
-                        iss.toggleMessage(pc, n)
+                    view.toggleMessage(int(command[1:]))
                 break
 
             else:
@@ -792,6 +2347,218 @@ def main():
      "*" to open/close all issues,
      "p" and an integer to expand/contract a path, or "*" to expand/contract all paths,
      "m" and an integer to expand/contract a message, or "*" to expand/contract all messages,
+     "n" and "b" to page forward and back, "g" and an integer to go to that path,
   or "q" to quit.{a.off}''')
-    
-    return 0
+
+        prefetching.cancel()
+    reader.close()
+
+
+def instrumentStages():
+    '''Wrap the stages --profile times: reading, building issues, parsing and rendering. The rules
+    the parsers match with count themselves.'''
+    module = sys.modules[__name__]
+    instrument.wrapGenerator(module, 'readDiagnosticBlocks', 'read and decode diagnostics')
+    instrument.wrapGenerator(module, 'replayStashCache', 'replay stash cache')
+    instrument.wrap(stashcache, 'openStashCache', 'open stash cache')
+    instrument.wrap(stashcache, 'writeStashCache', 'write stash cache')
+    instrument.wrap(PathTable, 'resolveFiles', 'resolve paths')
+    instrument.wrap(Issue, '__init__', 'build Issue', traced=False)
+    instrument.wrap(Issue, 'dedupKey', 'dedup key', traced=False)
+    instrument.wrap(module, 'renderMessage', 'renderMessage')
+    instrument.wrap(renderedMessages, 'get', 'rendered message lookup', fired=lambda rendered: rendered is not None, traced=False)
+    instrument.wrap(sharedGroups, 'get', 'shared group lookup', fired=lambda shared: shared is not None, traced=False)
+    instrument.wrap(renderedGroups, 'get', 'rendered group lookup', fired=lambda rendered: rendered is not None, traced=False)
+    instrument.wrap(treecache.TreeStore, 'get', 'tree store lookup', fired=lambda tree: tree is not None)
+    instrument.wrap(treecache.TreeStore, 'flush', 'tree store flush')
+    instrument.wrap(module, 'sanitizeMessage', 'sanitizeMessage')
+    instrument.wrap(module, 'matchBrackets', 'matchBrackets', traced=False)
+    instrument.wrap(ModdedString, 'modSubstring', 'modSubstring', traced=False)
+    instrument.wrap(ModdedString, 'render', 'ModdedString.render', traced=False)
+    instrument.wrap(Issue, 'renderLines', 'Issue.renderLines')
+    instrument.wrap(module, 'justifyMessage', 'justifyMessage')
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(prog='geg',
+        description='Prettifies and makes interactive the complex errors from gcc/g++ builds.')
+    parser.add_argument('--stash', default=compileErrorsPath,
+        help=f'where diagnostics are kept between runs (default: {compileErrorsPath})')
+    parser.add_argument('--compile-commands', metavar='PATH', dest='compileCommands',
+        help='compile every TU in a compile_commands.json, in parallel, and show all their issues')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='how many compilers to run at once with --compile-commands (default: one per core)')
+    parser.add_argument('--legacy-sanitizer', action='store_true', dest='legacySanitizer',
+        help='style messages with the old rewrite rules instead of the single-pass parser')
+    parser.add_argument('--batch', action='store_true',
+        help='write every issue out and exit, instead of showing them a screenful at a time')
+    parser.add_argument('-o', '--output', metavar='PATH',
+        help='write the issues to a file instead of stdout; implies --batch')
+    parser.add_argument('--width', type=int, default=None,
+        help='the width to wrap messages to with --batch (default: the terminal width, or 80)')
+    parser.add_argument('--no-color', action='store_true', dest='noColor',
+        help='write plain text, with no color escapes')
+    parser.add_argument('--open-issues', action='store_true', dest='openIssues',
+        help='start with every issue opened')
+    parser.add_argument('--open-paths', action='store_true', dest='openPaths',
+        help='start with every path expanded')
+    parser.add_argument('--open-messages', action='store_true', dest='openMessages',
+        help='start with every message expanded')
+    parser.add_argument('--profile', metavar='MODE[:PATH]',
+        help='time geg itself: "summary" prints how long each stage took when geg exits, '
+             '"cprofile[:PATH]" writes a cProfile and "chrome[:PATH]" a trace for chrome://tracing; '
+             'GEG_TRACE does the same')
+    parser.add_argument('command', nargs=argparse.REMAINDER,
+        help='the compiler command to run, or "-" to read diagnostics from stdin; '
+             'with no command, the stash from the last run is shown')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArgs(sys.argv[1:] if argv is None else argv)
+
+    global legacySanitizer
+    legacySanitizer = args.legacySanitizer
+    if (profile := args.profile or os.environ.get('GEG_TRACE')):
+        try:
+            instrument.start(profile)
+        except ValueError as e:
+            print (f'{a.Rgb(192, 0, 0).fg()}{e}{a.off}')
+            return 2
+        instrumentStages()
+    try:
+        elision.load(os.path.dirname(os.path.abspath(args.stash)))
+    except (OSError, UnicodeDecodeError, ValueError) as e:
+        print (f'{a.Rgb(192, 0, 0).fg()}{e}{a.off}')
+        return 2
+    if args.noColor:
+        setColored(False)
+    batch = args.batch or args.output is not None
+
+    proc = None
+    buildDriver = None
+    source = None
+    cache = None
+    # the lines of text and the issues as they're shown, for the stash cache; a batch doesn't keep them
+    shown = None if batch else []
+
+    def onText(text):
+        if shown is not None:
+            shown.append(text)
+        printText(text, out)
+
+    if args.compileCommands is not None:
+        try:
+            commands = driver.loadCompileCommands(args.compileCommands)
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            print (f'{a.Rgb(192, 0, 0).fg()}Could not read {args.compileCommands}: {e}{a.off}')
+            return 2
+        for command in commands:
+            command.arguments = makeJsonCommand(command.arguments)
+        buildDriver = driver.BuildDriver(commands, args.jobs)
+        blocks = driveBuild(buildDriver, args.stash, onText)
+    elif args.command == ['-']:
+        source = sys.stdin
+        shown = None
+    elif len(args.command) > 0:
+        try:
+            proc = doShellCommand(makeJsonCommand(args.command))
+        except OSError as e:
+            print (f'{a.Rgb(192, 0, 0).fg()}Could not run {args.command[0]}: {e}{a.off}')
+            return 127
+        source = TeeReader(proc.stderr, open(args.stash, 'w'))
+    elif os.path.exists(args.stash):
+        cache = stashcache.openStashCache(args.stash, elision.digest())
+        if cache is None:
+            source = open(args.stash)
+        else:
+            if not legacySanitizer:
+                messageTrees.update(cache.trees)
+            shown = None
+    else:
+        return 0
+
+    # only now there's something to write, so early returns don't leave an empty file behind
+    out = sys.stdout if args.output is None else open(args.output, 'w')
+
+    if cache is not None:
+        issueStream = replayStashCache(cache, onText)
+    else:
+        if source is not None:
+            blocks = readDiagnosticBlocks(instrument.reader(source, 'read stash'), onText=onText)
+            if proc is not None and (tu := sourceFileOf(args.command)) is not None:
+                blocks = tagBlocks(blocks, tu)
+        issueStream = (uniqueIssues if batch else dedupIssues)(buildIssues(blocks))
+
+    view = IssueView()
+    issues = view.issues
+    writer = BatchWriter(out, args.width) if batch else None
+
+    try:
+        for iss in issueStream:
+            if args.openIssues:
+                iss.toggleAllIssues()
+            if args.openPaths:
+                iss.toggleAllPaths()
+            if args.openMessages:
+                iss.toggleAllMessages()
+            if writer is not None:
+                writer.write(iss)
+                continue
+
+            if len(issues) == 0:
+                printDivision()
+            # show issues as they arrive, until the screen is full
+            view.add(iss)
+            if shown is not None:
+                shown.append(iss)
+            view.drawMore()
+    except json.JSONDecodeError as e:
+        print (f'{a.Rgb(192, 0, 0).fg()}Could not read diagnostics: {e}{a.off}')
+        return 1
+    finally:
+        if proc is not None:
+            source.sink.close()
+            proc.wait()
+        elif source is not None and source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    if shown is not None:
+        records = [item if isinstance(item, str) else issueRecord(item) for item in shown]
+        cache = stashcache.writeStashCache(args.stash, records, dict(messageTrees), elision.digest())
+    treeStore.flush()
+
+    returnCode = 0
+    if proc is not None:
+        returnCode = driver.exitCodeOf(proc.returncode)
+    elif buildDriver is not None:
+        returnCode = buildDriver.returnCode
+
+    if batch:
+        return returnCode
+
+    if source is sys.stdin:
+        # the diagnostics came down stdin, so take commands from the terminal instead
+        try:
+            sys.stdin = open('/dev/tty')
+        except OSError:
+            return returnCode
+
+    # parse what's under the issues while they're being looked at
+    prefetcher = MessagePrefetcher(issues)
+
+    view.printStatus()
+
+    if len(issues) > 0:
+        asyncio.run(interact(view))
+
+    prefetcher.close()
+    while len(prefetchedTrees) > 0:
+        messageTrees.update(prefetchedTrees.pop())
+    if cache is not None and len(messageTrees) > len(cache.trees):
+        cache.saveTrees(dict(messageTrees))
+    treeStore.flush()
+
+    return returnCode
@@ -0,0 +1,153 @@
+import sys
+import time
+import json
+import atexit
+import cProfile
+import functools
+
+# Timing and counting for geg's stages, switched on with --profile or GEG_TRACE. The functions it
+# times are wrapped when it's started, so until then, nothing is any slower. The modes are:
+#   summary          print how long each stage took, and how often, when geg exits
+#   cprofile[:PATH]  write a cProfile of the whole run to PATH (default: geg.prof)
+#   chrome[:PATH]    write a trace to PATH (default: geg-trace.json) for chrome://tracing or
+#                    Perfetto, and print the summary
+modes = {'summary': None, 'cprofile': 'geg.prof', 'chrome': 'geg-trace.json'}
+
+mode = None
+# whether stages are being counted and timed, for the rule loops that check rather than being wrapped
+active = False
+outPath = None
+profiler = None
+# stage: [calls, hits, seconds, skips]; time is inclusive of the stages called within
+stats = {}
+events = []
+startTime = 0
+
+
+def parseSpec(spec):
+    '''The (mode, path) a --profile or GEG_TRACE value asks for.'''
+    name, _, path = spec.partition(':')
+    if name not in modes:
+        raise ValueError(f'"{name}" isn\'t a profile mode; use one of {", ".join(modes)}')
+    return name, path or modes[name]
+
+
+now = time.perf_counter
+
+
+def start(spec):
+    global mode, active, outPath, profiler, startTime
+    mode, outPath = parseSpec(spec)
+    active = mode != 'cprofile'
+    startTime = time.perf_counter()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    atexit.register(finish)
+
+
+def record(stage, began, hit, traced):
+    now = time.perf_counter()
+    entry = stats.get(stage)
+    if entry is None:
+        entry = stats[stage] = [0, 0, 0.0, 0]
+    entry[0] += 1
+    entry[1] += hit
+    entry[2] += now - began
+    if traced and mode == 'chrome':
+        events.append({'name': stage, 'ph': 'X', 'pid': 0, 'tid': 0,
+                       'ts': (began - startTime) * 1e6, 'dur': (now - began) * 1e6})
+
+
+def skip(stage):
+    '''Count a call of stage that was skipped, as it couldn't have done anything.'''
+    entry = stats.get(stage)
+    if entry is None:
+        entry = stats[stage] = [0, 0, 0.0, 0]
+    entry[3] += 1
+
+
+def wrap(owner, name, stage, fired=None, traced=True):
+    '''Time each call of owner.name as stage. If fired is given, it says from the result whether
+    the call counts as a hit. Stages called very often aren't traced, to keep the trace loadable.'''
+    if mode is None or mode == 'cprofile':
+        return
+    fn = getattr(owner, name)
+
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        began = time.perf_counter()
+        result = fn(*args, **kwargs)
+        record(stage, began, fired is not None and fired(result), traced)
+        return result
+
+    setattr(owner, name, timed)
+
+
+def wrapGenerator(owner, name, stage):
+    '''Like wrap(), for a generator function: the time spent producing each item is a call.'''
+    if mode is None or mode == 'cprofile':
+        return
+    fn = getattr(owner, name)
+
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        items = fn(*args, **kwargs)
+        while True:
+            began = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            record(stage, began, False, True)
+            yield item
+
+    setattr(owner, name, timed)
+
+
+class TimedReader:
+    '''A stream whose readline() is timed as stage.'''
+    def __init__(self, stream, stage):
+        self.stream = stream
+        self.stage = stage
+
+
+    def readline(self, size=-1):
+        began = time.perf_counter()
+        line = self.stream.readline(size)
+        record(self.stage, began, False, False)
+        return line
+
+
+def reader(stream, stage):
+    '''The stream, timed if instrumenting.'''
+    if mode is None or mode == 'cprofile':
+        return stream
+    return TimedReader(stream, stage)
+
+
+def printSummary(file=None):
+    file = file or sys.stderr
+    total = time.perf_counter() - startTime
+    print (f'{"stage":32}{"calls":>10}{"hits":>10}{"skips":>10}{"total ms":>12}{"mean us":>10}', file=file)
+    for stage, (calls, hits, seconds, skips) in sorted(stats.items(), key=lambda item: -item[1][2]):
+        print (f'{stage:32}{calls:>10}{hits if hits > 0 else "":>10}{skips if skips > 0 else "":>10}'
+               f'{seconds * 1e3:>12.1f}{seconds / calls * 1e6 if calls > 0 else 0:>10.1f}', file=file)
+    print (f'{"whole run":32}{"":>30}{total * 1e3:>12.1f}', file=file)
+
+
+def finish():
+    global mode, active
+    if mode == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(outPath)
+        print (f'profile written to {outPath}', file=sys.stderr)
+    elif mode == 'chrome':
+        with open(outPath, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        printSummary()
+        print (f'trace written to {outPath}', file=sys.stderr)
+    elif mode == 'summary':
+        printSummary()
+    mode = None
+    active = False
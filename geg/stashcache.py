@@ -0,0 +1,140 @@
+import os
+import mmap
+import struct
+import hashlib
+import marshal
+
+# bump when the layout of the cache file changes
+cacheFormat = 2
+cacheMagic = b'gegcache'
+# magic, format, digest of the stash and of geg itself, where the records and the message trees start
+cacheHeader = struct.Struct('<8sI32sQQ')
+chunkSize = 1 << 20
+
+
+def cachePathOf(stashPath):
+    return f'{stashPath}.cache'
+
+
+def buildDigest():
+    '''Identifies this geg's code, since a change to the parser changes what it would cache.'''
+    h = hashlib.blake2b(digest_size=32)
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.py'):
+            with open(os.path.join(directory, name), 'rb') as f:
+                h.update(f.read())
+    return h.digest()
+
+
+def stashDigest(stashPath, codeDigest, settings):
+    h = hashlib.blake2b(codeDigest + settings, digest_size=32)
+    with open(stashPath, 'rb') as f:
+        while len(chunk := f.read(chunkSize)) > 0:
+            h.update(chunk)
+    return h.digest()
+
+
+class StashCache:
+    '''A stash's issues, already parsed and deduped, kept in a file next to it. The file is mapped
+    rather than read: the top-level records are decoded when it's opened, and the blocks under each
+    issue only when they're asked for.
+
+    The records are, in the order they were shown, either a line of text or an issue's (kind, file,
+    line, message, occurrences, sources, blocks offset, blocks length). The message trees that were
+    rendered go at the end, so they can be rewritten without touching the rest.'''
+    def __init__(self, path, digest, records, trees, treesOffset, mapped):
+        self.path = path
+        self.digest = digest
+        self.records = records
+        self.trees = trees
+        self.treesOffset = treesOffset
+        self.mapped = mapped
+
+
+    def blocks(self, offset, length):
+        '''The (children, notes) blocks of an issue.'''
+        return marshal.loads(self.mapped[offset : offset + length])
+
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+
+    def saveTrees(self, trees):
+        '''Replace the message trees at the end of the file.'''
+        self.close()
+        with open(self.path, 'r+b') as f:
+            f.seek(self.treesOffset)
+            f.write(marshal.dumps(trees))
+            f.truncate()
+        self.trees = trees
+
+
+def openStashCache(stashPath, settings=b''):
+    '''The cache for a stash, or None if there isn't one that matches what's in the stash now. The
+    settings are bytes standing for anything else that changes how messages parse, which has to be
+    the same as when the cache was written.'''
+    path = cachePathOf(stashPath)
+    try:
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+    try:
+        digest = stashDigest(stashPath, buildDigest(), settings)
+        magic, format, cachedDigest, recordsOffset, treesOffset = cacheHeader.unpack_from(mapped)
+        if magic != cacheMagic or format != cacheFormat or cachedDigest != digest:
+            mapped.close()
+            return None
+        records = marshal.loads(mapped[recordsOffset : treesOffset])
+        trees = marshal.loads(mapped[treesOffset:])
+    except (OSError, struct.error, EOFError, ValueError, TypeError):
+        mapped.close()
+        return None
+
+    return StashCache(path, digest, records, trees, treesOffset, mapped)
+
+
+def writeStashCache(stashPath, records, trees, settings=b''):
+    '''Write the cache for a stash. Issue records carry their (children, notes) blocks in place of the
+    offset and length, which are filled in here. The cache is written aside and moved into place, so
+    another geg never sees half of one. Returns the cache, to save more message trees in later, or
+    None if it couldn't be written.'''
+    path = cachePathOf(stashPath)
+    tempPath = f'{path}.{os.getpid()}'
+    try:
+        digest = stashDigest(stashPath, buildDigest(), settings)
+        with open(tempPath, 'wb') as f:
+            f.write(bytes(cacheHeader.size))
+            indexed = []
+            for record in records:
+                if isinstance(record, str):
+                    indexed.append(record)
+                    continue
+                *fields, blocks = record
+                if blocks is None:
+                    indexed.append((*fields, 0, 0))
+                    continue
+                data = marshal.dumps(blocks)
+                indexed.append((*fields, f.tell(), len(data)))
+                f.write(data)
+
+            recordsOffset = f.tell()
+            f.write(marshal.dumps(indexed))
+            treesOffset = f.tell()
+            f.write(marshal.dumps(trees))
+            f.seek(0)
+            f.write(cacheHeader.pack(cacheMagic, cacheFormat, digest, recordsOffset, treesOffset))
+        os.replace(tempPath, path)
+        return StashCache(path, digest, indexed, trees, treesOffset, None)
+    except OSError:
+        # a full disk or a stash in a read-only directory: the stash is read again next time instead
+        try:
+            os.remove(tempPath)
+        except OSError:
+            pass
+        return None
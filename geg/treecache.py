@@ -0,0 +1,127 @@
+import os
+import time
+import marshal
+import hashlib
+try:
+    import sqlite3
+except ImportError:
+    # some Pythons are built without it; messages are just parsed every time then
+    sqlite3 = None
+
+from . import stashcache
+
+# bump when the way trees are kept changes
+storeFormat = 2
+defaultMaxBytes = 64 << 20
+# new trees held before they're written out anyway
+flushBytes = 4 << 20
+
+
+def cacheDirectory():
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'geg')
+
+
+class TreeStore:
+    '''Parsed message trees, kept in a SQLite database shared by every geg run on the machine, so the
+    huge types a codebase's diagnostics repeat build after build are parsed once. Trees are keyed by
+    the text the parser sees and the options it parsed with. The store is emptied whenever geg's code
+    changes, and the least recently used trees are dropped once it holds more than maxBytes of them.
+
+    New trees and uses are written by flush(), in one transaction, and whenever more than flushBytes
+    of new trees are waiting.'''
+    def __init__(self, path, maxBytes=defaultMaxBytes):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.db = None
+        self.broken = sqlite3 is None
+        self.added = {}
+        self.addedBytes = 0
+        self.used = set()
+
+
+    def keyOf(self, text, makeOpened, highlighted):
+        return hashlib.blake2b(marshal.dumps((text, makeOpened, highlighted)), digest_size=16).digest()
+
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=5)
+        version = marshal.dumps((storeFormat, stashcache.buildDigest()))
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value BLOB)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS trees '
+                            '(key BLOB PRIMARY KEY, tree BLOB NOT NULL, size INTEGER NOT NULL, used REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS treesByUse ON trees (used)')
+            row = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()
+            if row is None or row[0] != version:
+                self.db.execute('DELETE FROM trees')
+                self.db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (version,))
+
+
+    def connected(self):
+        '''Whether the store can be used, opening it the first time.'''
+        if self.db is None and not self.broken:
+            try:
+                self.open()
+            except (OSError, sqlite3.Error):
+                # no writable cache directory, or a trees.sqlite that's corrupt or locked by another
+                # geg: every message is parsed, as if the store were empty
+                self.broken = True
+        return not self.broken
+
+
+    def get(self, text, makeOpened, highlighted):
+        '''The ModdedString.toTuple() of a message parsed before, or None.'''
+        if not self.connected():
+            return None
+        key = self.keyOf(text, makeOpened, highlighted)
+        if key in self.added:
+            return marshal.loads(self.added[key])
+        try:
+            row = self.db.execute('SELECT tree FROM trees WHERE key = ?', (key,)).fetchone()
+        except sqlite3.Error:
+            self.broken = True
+            return None
+        if row is None:
+            return None
+        self.used.add(key)
+        return marshal.loads(row[0])
+
+
+    def put(self, text, makeOpened, highlighted, tree):
+        if self.connected():
+            data = marshal.dumps(tree)
+            self.added[self.keyOf(text, makeOpened, highlighted)] = data
+            self.addedBytes += len(data)
+            if self.addedBytes > flushBytes:
+                self.flush()
+
+
+    def flush(self):
+        if self.db is None or self.broken or (len(self.added) == 0 and len(self.used) == 0):
+            return
+        now = time.time()
+        try:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO trees VALUES (?, ?, ?, ?)',
+                                    [(key, tree, len(tree), now) for key, tree in self.added.items()])
+                self.db.executemany('UPDATE trees SET used = ? WHERE key = ?', [(now, key) for key in self.used])
+                self.evict()
+        except sqlite3.Error:
+            self.broken = True
+        self.added = {}
+        self.addedBytes = 0
+        self.used = set()
+
+
+    def evict(self):
+        total = self.db.execute('SELECT TOTAL(size) FROM trees').fetchone()[0]
+        if total <= self.maxBytes:
+            return
+        stale = []
+        for key, size in self.db.execute('SELECT key, size FROM trees ORDER BY used'):
+            stale.append((key,))
+            total -= size
+            if total <= self.maxBytes:
+                break
+        self.db.executemany('DELETE FROM trees WHERE key = ?', stale)
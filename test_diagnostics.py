@@ -0,0 +1,59 @@
+'''Checks how readDiagnosticBlocks() tells diagnostics from the other text a build prints. Run with
+pytest, or as a script.'''
+import io
+import json
+from geg import geg
+
+blocks = [
+    {'kind': 'error', 'message': 'first', 'locations': []},
+    {'kind': 'warning', 'message': 'second', 'locations': []},
+    {'kind': 'error', 'message': 'third', 'locations': [], 'children': [{'kind': 'note', 'message': 'why'}]},
+]
+
+# what a build's stderr might hold: JSON from the compiler between lines that aren't
+stream = '\n'.join([
+    '[ 50%] Building CXX object foo.cpp.o',
+    json.dumps(blocks[:2]),
+    '{standard input}: Assembler messages:',
+    '{standard input}:12: Error: no such instruction',
+    '',
+    json.dumps(blocks[2], indent=2),
+    '[]',
+    'collect2: error: ld returned 1 exit status',
+    '{not json either',
+]) + '\n'
+
+texts = [
+    '[ 50%] Building CXX object foo.cpp.o',
+    '{standard input}: Assembler messages:',
+    '{standard input}:12: Error: no such instruction',
+    'collect2: error: ld returned 1 exit status',
+    '{not json either',
+]
+
+
+def read(chunkSize):
+    shown = []
+    found = list(geg.readDiagnosticBlocks(io.StringIO(stream), chunkSize, shown.append))
+    return found, shown
+
+
+def test_mixedStream():
+    for chunkSize in (1 << 16, 7, 1):
+        found, shown = read(chunkSize)
+        assert found == blocks, chunkSize
+        assert shown == texts, chunkSize
+
+
+def test_truncatedBlock():
+    try:
+        list(geg.readDiagnosticBlocks(io.StringIO(json.dumps(blocks)[:-10])))
+    except json.JSONDecodeError:
+        return
+    assert False, 'a truncated block should raise'
+
+
+if __name__ == '__main__':
+    test_mixedStream()
+    test_truncatedBlock()
+    print ('blocks and text read apart')
@@ -0,0 +1,53 @@
+'''Checks what elision.elide() cuts out of messages. Run with pytest, or as a script.'''
+from geg import elision
+
+rules = ['std::allocator', 'std::less', 'mylib::policy::*']
+
+# (message, what's left of it)
+cases = [
+    # a template argument after a comma goes with its comma
+    ('std::vector<int, std::allocator<int>>',                   'std::vector<int>'),
+    ('std::map<int, int, std::less<int>, std::allocator<std::pair<const int, int>>>',
+                                                                'std::map<int, int>'),
+    ('x<a, std::allocator<int>, (b<c)>',                        'x<a, (b<c)>'),
+    # anywhere else, it leaves a mark
+    ('no match for ‘std::allocator<int>’',                      'no match for ‘…’'),
+    ('std::allocator<int>::rebind',                             '…::rebind'),
+    # code spans close whatever brackets were opened in them
+    ('in ‘f<int, std::allocator<int>>’ and ‘g(a, std::allocator<int>)’',
+                                                                'in ‘f<int>’ and ‘g(a, …)’'),
+    ('‘a<b’, std::allocator<int> here',                         '‘a<b’, … here'),
+    # template arguments that don't close, before the message or its code span ends, are left be
+    ('std::allocator<int',                                      'std::allocator<int'),
+    ('‘std::allocator<int’ x',                                  '‘std::allocator<int’ x'),
+    # arguments in parens aren't template arguments, even inside some
+    ('f(std::vector<int, std::allocator<int>>, std::allocator<int>)',
+                                                                'f(std::vector<int>, …)'),
+    ('std::function<void(int, std::allocator<int>)>',           'std::function<void(int, …)>'),
+    # * stands for one whole name
+    ('T<int, mylib::policy::Fast>',                             'T<int>'),
+    ('mylib::policy::',                                         'mylib::policy::'),
+    ('mylib::policy::detail::X',                                'mylib::policy::detail::X'),
+    # only whole names match
+    ('my::std::allocator<int> and std::allocators',             'my::std::allocator<int> and std::allocators'),
+]
+
+
+def test_elide():
+    elision.setRules(rules)
+    try:
+        for message, elided in cases:
+            assert elision.elide(message) == elided, message
+    finally:
+        elision.setRules([])
+
+
+def test_noRules():
+    elision.setRules([])
+    assert elision.elide(cases[0][0]) == cases[0][0]
+
+
+if __name__ == '__main__':
+    test_elide()
+    test_noRules()
+    print (f'{len(cases)} cases passed')
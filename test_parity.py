@@ -0,0 +1,80 @@
+'''Checks that MessageParser shows messages the way the old rewrite rules (--legacy-sanitizer) do:
+the same characters, in the same colors, with the same ones hidden. Run with pytest, or as a script,
+after changing either one, or ModdedString or the styles under them.'''
+from geg import geg
+
+# test.py's message
+errorm = '''‘template<class _Ostream, class _Tp> typename std::enable_if<std::__and_<std::__not_<std::is_lvalue_reference<_Tp> >, std::__is_convertible_to_basic_ostream<_Ostream>, std::__is_insertable<typename std::__is_convertible_to_basic_ostream<_Tp>::__ostream_type, const _Tp&, void>>::value, typename std::__is_convertible_to_basic_ostream<_Tp>::__ostream_type>::type std::operator<<(_Ostream&&, const _Tp&)’'''
+
+corpus = [
+    errorm,
+    '‘std::istream’ {aka ‘std::basic_istream<char>’} is not derived from ‘std::basic_ostream<_CharT, _Traits>’',
+    'no match for ‘operator<<’ (operand types are ‘std::ostream’ {aka ‘std::basic_ostream<char>’} and ‘Foo’)',
+    'no match for ‘operator==’ (operand types are ‘const Foo’ and ‘const Foo’)',
+    '‘operator()’ is not a member of ‘Foo::Bar<int>::type’',
+    'cannot bind non-const lvalue reference of type ‘std::basic_ostream<char>::__ostream_type&’ {aka ‘std::basic_ostream<char>&’} to an rvalue of type ‘std::basic_ostream<char>::__ostream_type’ {aka ‘std::basic_ostream<char>’}',
+    '‘class std::vector<int, std::allocator<int> >’ has no member named ‘push’',
+    'no matching function for call to ‘std::map<std::__cxx11::basic_string<char>, int>::insert(int)’',
+    '‘constexpr const _Tp& std::max(const _Tp&, const _Tp&) [with _Tp = long unsigned int]’',
+    '‘std::unique_ptr<_Tp, _Dp>::unique_ptr(const std::unique_ptr<_Tp, _Dp>&) [with _Tp = Widget; _Dp = std::default_delete<Widget>]’ is implicitly deleted',
+    'in instantiation of ‘struct std::tuple_element<3, std::tuple<int, float, char> >’',
+    'invalid conversion from ‘const char*’ to ‘int’ [-fpermissive]',
+    'template argument deduction/substitution failed:',
+    'expected ‘;’ before ‘}’ token',
+    '   42 |     auto x = std::get<0>(t) + *p && q;',
+]
+
+# The old rules rewrote an operator's parameters a second time, styling them as an operator and
+# lifting a leading '__' off the first one; the parser styles them as parameters, and leaves it.
+operatorm = '''candidate: ‘std::basic_ostream<_CharT, _Traits>::__ostream_type& std::basic_ostream<_CharT, _Traits>::operator<<(__ostream_type& (*)(__ostream_type&)) [with _CharT = char; _Traits = std::char_traits<char>; __ostream_type = std::basic_ostream<char>]’'''
+operatorShown = '''candidate: ‘ostream<CharT, Traits>::ostream_type& ostream<CharT, Traits>::operator<<(ostream_type& (*)(ostream_type&)) [with _CharT = char; _Traits = ; __ostream_type = ostream<char>]’'''
+
+
+def shown(node):
+    '''Each character the tree shows, with its colors.'''
+    out = []
+    def walk(node, parentKey):
+        key = geg.Style.cascadeKeys(node.styles, parentKey)
+        if key & geg.invisibleStyle:
+            return
+        if node.shared is not None:
+            node = geg.ModdedString.fromTuple(node.backing[node.start:node.end], node.shared)
+        colors = geg.Style.colorsOf(key)
+        pos = node.start
+        for child in node.children:
+            out.extend((ch, colors) for ch in node.backing[pos:child.start])
+            walk(child, key)
+            pos = child.end
+        out.extend((ch, colors) for ch in node.backing[pos:node.end])
+    walk(node, 0)
+    return out
+
+
+def parsings(message):
+    for makeOpened in (False, True):
+        for highlighted in (False, True):
+            yield (makeOpened, highlighted,
+                   geg.rewriteMessage(message, makeOpened, highlighted),
+                   geg.MessageParser(makeOpened).parse(message, highlighted))
+
+
+def test_parity():
+    for message in corpus:
+        for makeOpened, highlighted, old, new in parsings(message):
+            assert shown(new) == shown(old), (message, makeOpened, highlighted)
+
+
+def test_operatorRewrite():
+    for makeOpened, highlighted, old, new in parsings(operatorm):
+        assert shown(new) != shown(old)
+        text = ''.join(ch for ch, _ in shown(new))
+        if makeOpened:
+            assert text == ''.join(ch for ch, _ in shown(old))
+        else:
+            assert text == operatorShown
+
+
+if __name__ == '__main__':
+    test_parity()
+    test_operatorRewrite()
+    print (f'{len(corpus)} messages shown the same, and the operator rewrite as expected')